@@ -0,0 +1,93 @@
+import unicodedata
+
+# Punctuation that separates words ("Guinea-Bissau", "Saint/Pierre"); any other punctuation is dropped
+word_separators = set("-_/‐‑‒–—")
+
+# Turn an answer or guess into the form used for comparisons: accents removed, casefolded,
+# punctuation removed and whitespace collapsed, so "Réunion" and "reunion" are the same answer
+def normalize_answer(text):
+    decomposed = unicodedata.normalize("NFKD", text)
+    characters = []
+    for char in decomposed:
+        category = unicodedata.category(char)
+        if category == "Mn":
+            continue  # Combining accent mark
+        if category.startswith("P"):
+            if char in word_separators:
+                characters.append(" ")
+            continue
+        characters.append(char)
+    return " ".join("".join(characters).casefold().split())
+
+# Prefix tree over normalized answers, used for autocomplete without scanning the whole catalog
+class PrefixTrie:
+    def __init__(self):
+        self.root = {}  # Character -> child node; the "" key holds the answer spelling ending here
+
+    def insert(self, key, display):
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault("", display)  # Keep the first spelling registered for this answer
+
+    def suggest(self, prefix, limit=5):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+
+        # Depth first walk in alphabetical order, stopping as soon as enough answers are found
+        suggestions = []
+        stack = [node]
+        while stack and len(suggestions) < limit:
+            node = stack.pop()
+            if "" in node:
+                suggestions.append(node[""])
+            stack.extend(node[char] for char in sorted((c for c in node if c), reverse=True))
+        return suggestions
+
+    # Every normalized answer starting with prefix, in no particular order
+    def keys_with_prefix(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return
+        stack = [(node, prefix)]
+        while stack:
+            node, key = stack.pop()
+            if "" in node:
+                yield key
+            stack.extend((child, key + char) for char, child in node.items() if char)
+
+# Maps every normalized answer to the flags it is valid for, built once when the flags are loaded
+class AnswerIndex:
+    def __init__(self, flags=None):
+        self.answers = {}  # Normalized answer -> set of flag names
+        self.spellings = {}  # Normalized answer -> first spelling registered for it, for display
+        self.trie = PrefixTrie()
+        for flag_name, valid_answers in (flags or {}).items():
+            self.add(flag_name, flag_name)
+            for answer in valid_answers:
+                self.add(flag_name, answer)
+
+    def add(self, flag_name, answer):
+        key = normalize_answer(answer)
+        if not key:
+            return
+        self.answers.setdefault(key, set()).add(flag_name)
+        self.spellings.setdefault(key, answer.strip())
+        self.trie.insert(key, answer.strip())
+
+    def matches(self, flag_name, guess):
+        return flag_name in self.answers.get(normalize_answer(guess), ())
+
+    def suggest(self, prefix, limit=5):
+        key = normalize_answer(prefix)
+        if key and prefix[-1:].isspace():
+            key += " "  # The player finished a word, so only suggest answers that continue with another
+        return self.trie.suggest(key, limit) if key else []
+
+    def __len__(self):
+        return len(self.answers)
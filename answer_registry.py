@@ -0,0 +1,134 @@
+import os
+import csv
+import io
+import time
+import queue
+import threading
+
+# Registered answers are appended to a journal next to valid_answers.csv by a background thread,
+# so registering costs the same however big the CSV is. The journal is folded back into the CSV
+# now and then (and on close) by writing a new file and renaming it over the old one.
+
+def journal_path_for(answers_file):
+    return os.path.splitext(answers_file)[0] + ".journal"
+
+# Read journal entries as (flag name, answer) pairs. A line without its newline was cut off by a
+# crash mid-write, so it is ignored rather than half applied.
+def read_journal(journal_path):
+    if not os.path.exists(journal_path):
+        return []
+    with open(journal_path, mode='r', encoding='utf-8', newline='') as file:
+        text = file.read()
+    if not text.endswith("\n"):
+        text = text[:text.rfind("\n") + 1]
+    return [(row[0], row[1]) for row in csv.reader(io.StringIO(text)) if len(row) == 2]
+
+# Apply journal entries to a flag name -> answers tuple dict, skipping answers already present
+def replay_journal(journal_path, answers):
+    for flag_name, answer in read_journal(journal_path):
+        existing = answers.get(flag_name, ())
+        if answer not in existing:
+            answers[flag_name] = existing + (answer,)
+    return answers
+
+# Cut off a partly written last line, so new entries don't get glued onto it
+def repair_journal(journal_path):
+    if not os.path.exists(journal_path):
+        return
+    with open(journal_path, mode='r+b') as file:
+        data = file.read()
+        if data and not data.endswith(b"\n"):
+            file.truncate(data.rfind(b"\n") + 1)
+
+def read_answers_csv(answers_file):
+    answers = {}
+    if os.path.exists(answers_file):
+        with open(answers_file, mode='r', encoding='utf-8') as file:
+            for row in csv.reader(file):
+                if row:
+                    # Remove duplicates while keeping the order they were registered in
+                    answers[row[0].strip()] = tuple(dict.fromkeys(answer.strip() for answer in row[1:]))
+    return answers
+
+# Write rows to a temporary file, fsync it and rename it over the target, so readers only ever
+# see the old file or the complete new one
+def write_answers_csv(answers_file, answers):
+    temp_path = answers_file + ".tmp"
+    with open(temp_path, mode='w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        for flag_name, flag_answers in answers.items():
+            writer.writerow([flag_name] + list(flag_answers))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, answers_file)
+
+class AnswerRegistry:
+    def __init__(self, answers_file, flush_interval=0.5, compact_every=200, compact_interval=60.0):
+        self.answers_file = answers_file
+        self.journal_path = journal_path_for(answers_file)
+        self.flush_interval = flush_interval  # Longest a registration waits before being fsynced
+        self.compact_every = compact_every  # Journal entries that trigger a compaction
+        self.compact_interval = compact_interval  # Seconds after which a non-empty journal is compacted
+        self.pending = queue.Queue()
+        repair_journal(self.journal_path)
+        self.journal_entries = len(read_journal(self.journal_path))
+        self.last_compaction = time.monotonic()
+        self.writer = threading.Thread(target=self.writer_loop, name="answer-writer", daemon=True)
+        self.writer.start()
+
+    # Queue an answer for writing; returns straight away
+    def register(self, flag_name, answer):
+        self.pending.put((flag_name, answer))
+
+    # Block until everything registered so far is safely in the journal
+    def flush(self):
+        self.pending.join()
+
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+
+    def writer_loop(self):
+        running = True
+        while running:
+            try:
+                batch = [self.pending.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                batch = []
+            # Take everything else already waiting, so one fsync covers the whole batch
+            while True:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            entries = [entry for entry in batch if entry is not None]
+            running = len(entries) == len(batch)
+            try:
+                if entries:
+                    self.append_to_journal(entries)
+                due = time.monotonic() - self.last_compaction >= self.compact_interval
+                if self.journal_entries and (not running or self.journal_entries >= self.compact_every or due):
+                    self.compact()
+            except OSError as e:
+                print(f"Failed to save registered answers: {e}")
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+    def append_to_journal(self, entries):
+        with open(self.journal_path, mode='a', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, lineterminator="\n")
+            writer.writerows(entries)
+            file.flush()
+            os.fsync(file.fileno())
+        self.journal_entries += len(entries)
+
+    # Fold the journal into valid_answers.csv. The CSV is replaced before the journal is removed;
+    # a crash in between only means the same entries get replayed (and skipped) next start.
+    def compact(self):
+        answers = replay_journal(self.journal_path, read_answers_csv(self.answers_file))
+        write_answers_csv(self.answers_file, answers)
+        os.remove(self.journal_path)
+        self.journal_entries = 0
+        self.last_compaction = time.monotonic()
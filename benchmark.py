@@ -0,0 +1,378 @@
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import contextlib
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from answer_registry import AnswerRegistry, write_answers_csv
+from flag_catalog import load_flags
+from fuzzy_match import synthetic_names, misspell
+from game_engine import FlagGameEngine, GameData
+
+# Reproducible timings for the scrape, download, load and play hot paths on synthetic catalogs.
+# Every stage writes its fixtures into a temporary folder, and the results are printed (or
+# saved) as JSON so runs can be compared over time. Stages whose optional dependencies are not
+# installed are reported as skipped instead of failing the whole run.
+
+stages = ["catalog", "guess", "save", "images", "scrape", "download"]
+
+def measure(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda fraction: values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+    return {"mean_us": sum(values) / max(len(values), 1) * 1e6, "p50_us": pick(0.5) * 1e6,
+            "p95_us": pick(0.95) * 1e6, "p99_us": pick(0.99) * 1e6, "calls": len(values)}
+
+# A flags folder (empty placeholder PNGs, only the names matter) and a valid_answers.csv
+def write_catalog_fixture(folder, names, seed=0):
+    rng = random.Random(seed)
+    flags_folder = os.path.join(folder, "flags")
+    os.makedirs(flags_folder, exist_ok=True)
+    for name in names:
+        open(os.path.join(flags_folder, f"{name}.png"), "wb").close()
+    answers = {}
+    for name in rng.sample(names, len(names) // 3):
+        answers[name] = tuple(dict.fromkeys([name.split()[0], name.lower(), misspell(name, rng)]))
+    answers_file = os.path.join(folder, "valid_answers.csv")
+    write_answers_csv(answers_file, answers)
+    return flags_folder, answers_file
+
+def bench_catalog(size, folder, results):
+    names = synthetic_names(size)
+    flags_folder, answers_file = write_catalog_fixture(folder, names)
+    results.append({"stage": "catalog", "case": "load_flags", "size": size,
+                    "seconds": measure(lambda: load_flags(flags_folder, answers_file))})
+    catalog = load_flags(flags_folder, answers_file)
+    results.append({"stage": "catalog", "case": "build_answer_index", "size": size,
+                    "seconds": measure(lambda: GameData(catalog), repeat=1)})
+
+    # What the game does at startup: a cached catalog, and the answer index built in the background
+    cache_path = os.path.join(folder, "catalog.pickle")
+    load_flags(flags_folder, answers_file, cache_path=cache_path)
+    results.append({"stage": "catalog", "case": "load_flags_cached", "size": size,
+                    "seconds": measure(lambda: load_flags(flags_folder, answers_file, cache_path=cache_path))})
+    first_question = lambda: FlagGameEngine(GameData(load_flags(flags_folder, answers_file, cache_path=cache_path),
+                                                     background=True)).next_flag()
+    results.append({"stage": "catalog", "case": "time_to_first_question", "size": size,
+                    "seconds": measure(first_question)})
+
+def bench_guess(size, folder, results, questions=300):
+    rng = random.Random(1)
+    names = synthetic_names(size)
+    flags_folder, answers_file = write_catalog_fixture(folder, names)
+    data = GameData(load_flags(flags_folder, answers_file))
+    engine = FlagGameEngine(data, rng)
+
+    keystrokes = []
+    submits = []
+    for _ in range(min(questions, engine.total_flags)):
+        flag_name = engine.next_flag()
+        guess = misspell(flag_name, rng) if rng.random() < 0.3 else flag_name
+        # auto_submit_if_correct runs on every key release, check_guess when it's submitted
+        for length in range(1, len(guess) + 1):
+            start = time.perf_counter()
+            correct = engine.is_correct(guess[:length])
+            keystrokes.append(time.perf_counter() - start)
+            if correct:
+                break
+        start = time.perf_counter()
+        engine.check_guess(guess)
+        submits.append(time.perf_counter() - start)
+    results.append({"stage": "guess", "case": "auto_submit_if_correct", "size": size, **percentiles(keystrokes)})
+    results.append({"stage": "guess", "case": "check_guess", "size": size, **percentiles(submits)})
+
+def bench_save(size, folder, results, registrations=500):
+    names = synthetic_names(size)
+    _, answers_file = write_catalog_fixture(folder, names)
+    answers = {name: (name,) for name in names}
+
+    # What save_valid_answers used to do for every registration: rewrite the whole CSV
+    results.append({"stage": "save", "case": "rewrite_valid_answers", "size": size,
+                    "seconds": measure(lambda: write_answers_csv(answers_file, answers))})
+
+    registry = AnswerRegistry(answers_file, compact_every=10 ** 9, compact_interval=10 ** 9)
+    latencies = []
+    for index in range(registrations):
+        start = time.perf_counter()
+        registry.register(names[index % len(names)], f"answer {index}")
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    registry.flush()
+    flush_time = time.perf_counter() - start
+    results.append({"stage": "save", "case": "register_answer", "size": size, **percentiles(latencies)})
+    results.append({"stage": "save", "case": "journal_flush", "size": size, "seconds": flush_time,
+                    "entries": registrations})
+    start = time.perf_counter()
+    registry.compact()
+    results.append({"stage": "save", "case": "compact", "size": size, "seconds": time.perf_counter() - start})
+    registry.close()
+
+# Striped flags of a few common shapes, saved as PNGs larger than the display size
+def write_image_fixtures(folder, count):
+    from PIL import Image, ImageDraw
+    rng = random.Random(2)
+    os.makedirs(folder, exist_ok=True)
+    names = []
+    for index in range(count):
+        width, height = rng.choice([(900, 600), (1000, 500), (600, 600), (750, 500)])
+        img = Image.new("RGB", (width, height))
+        draw = ImageDraw.Draw(img)
+        stripes = rng.randint(2, 5)
+        for stripe in range(stripes):
+            colour = tuple(rng.randrange(256) for _ in range(3))
+            draw.rectangle([0, stripe * height // stripes, width, (stripe + 1) * height // stripes], fill=colour)
+        name = f"Flag {index}"
+        img.save(os.path.join(folder, f"{name}.png"))
+        names.append(name)
+    return names
+
+def bench_images(size, folder, results, count=200):
+    import flag_bundle
+    from image_cache import FlagImageCache
+    count = min(size, count)
+    flags_folder = os.path.join(folder, "flags")
+    names = write_image_fixtures(flags_folder, count)
+
+    # show_flag_image without a bundle: open, decode and resize a PNG on every question
+    results.append({"stage": "images", "case": "show_flag_image_png", "size": count,
+                    "seconds": measure(lambda: [flag_bundle.load_flag_image(name, None, flags_folder) for name in names]) / count})
+
+    bundle_path = os.path.join(folder, "flags.bundle")
+    results.append({"stage": "images", "case": "build_bundle", "size": count,
+                    "seconds": measure(lambda: flag_bundle.build_bundle(flags_folder, bundle_path), repeat=1)})
+    bundle = flag_bundle.FlagBundle(bundle_path)
+    results.append({"stage": "images", "case": "show_flag_image_bundle", "size": count,
+                    "seconds": measure(lambda: [flag_bundle.load_flag_image(name, bundle) for name in names]) / count})
+
+    # Cache hits are what the game sees once the prefetcher has kept up
+    cache = FlagImageCache(lambda name: flag_bundle.load_flag_image(name, None, flags_folder), capacity=count)
+    cache.prefetch(names)
+    cache.pending.join()
+    results.append({"stage": "images", "case": "show_flag_image_cached", "size": count,
+                    "seconds": measure(lambda: [cache.get(name) for name in names]) / count})
+
+# HTML shaped like the three Wikipedia pages wiki_flags.py scrapes, with size flags in total
+def synthetic_pages(size):
+    names = synthetic_names(size)
+    third = len(names) // 3
+    url = "//upload.wikimedia.org/wikipedia/commons/thumb/a/ab/Flag_of_{}.svg/120px-Flag_of_{}.svg.png"
+    filler = "<p>" + "Lorem ipsum dolor sit amet. " * 20 + "</p>"
+    # What a real page has around the flags whatever their number: navigation boxes, references
+    # and the skin's menus, about 400 KB of markup that none of the extractors need
+    links = "".join(f'<li><a href="/wiki/Topic_{i}" title="Topic {i}">Topic {i}</a></li>' for i in range(60))
+    chrome = "".join(f'<div class="navbox"><div class="navbox-title">Section {i}</div><ul>{links}</ul></div>'
+                     for i in range(80))
+
+    rows = "".join(f'<tr><td><span><img src="{url.format(i, i)}" alt=""></span> <a href="/wiki/{name}">{name}</a></td>'
+                   f"<td>Adopted {1900 + i % 100}</td><td>{filler}</td></tr>" for i, name in enumerate(names[:third]))
+    sovereign = f'<html><body>{chrome}<table class="wikitable"><tr><th>Flag</th><th>Date</th><th>Use</th></tr>{rows}</table>{chrome}</body></html>'
+
+    images = "".join(f'<li><img src="{url.format(i, i)}" alt="Flag of {name}"> {filler}</li>'
+                     for i, name in enumerate(names[third:2 * third]))
+    cities = f'<html><body>{chrome}<img src="//en.wikipedia.org/static/images/icons/wikipedia.png" alt="Wikipedia"><ul>{images}</ul></body></html>'
+
+    boxes = "".join(f'<li class="gallerybox"><div class="thumb"><img src="{url.format(i, i)}"></div>'
+                    f'<div class="gallerytext"><a href="/wiki/{name}">{name}</a></div></li>'
+                    for i, name in enumerate(names[2 * third:]))
+    territories = f'<html><body>{chrome}{filler}<ul class="gallery">{boxes}</ul>{chrome}</body></html>'
+    return {"sovereign_states": sovereign.encode("utf-8"), "city_flags": cities.encode("utf-8"),
+            "dependent_territories": territories.encode("utf-8")}
+
+# Saved copies of the pages, named like wiki_flags.py's page cache (cache/pages works as html_dir)
+def load_saved_pages(html_dir):
+    pages = {}
+    for page in ("sovereign_states", "city_flags", "dependent_territories"):
+        with open(os.path.join(html_dir, f"{page}.html"), "rb") as file:
+            pages[page] = file.read()
+    return pages
+
+# Run in a fresh process by peak_rss: parse saved pages and print how far resident memory (KB)
+# peaked above where it was just before. An empty warm-up parse runs first so lazily imported
+# modules are loaded, then the kernel's peak counter is reset to the current RSS (clear_refs), so
+# neither import-time peaks nor the warm-up count towards the parse.
+rss_script = """
+import os, sys, gc, wiki_flags
+def status(field):
+    with open("/proc/self/status") as file:
+        return next(int(line.split()[1]) for line in file if line.startswith(field + ":"))
+pages = {page: open(os.path.join(sys.argv[1], page + ".html"), "rb").read() for page in wiki_flags.source_pages}
+wiki_flags.parse_flags({}, sys.argv[2] == "targeted", sys.argv[3])  # Only the (empty) dependent territories page
+gc.collect()
+with open("/proc/self/clear_refs", "w") as file:
+    file.write("5")
+before = status("VmRSS")
+wiki_flags.parse_flags(pages, sys.argv[2] == "targeted", sys.argv[3])
+print(before, status("VmHWM"))
+"""
+
+# How much parsing raised peak resident memory (MB), in a separate process per case. RSS counts
+# the C allocations of lxml/libxml2 that tracemalloc can't see. Linux only; None elsewhere.
+def peak_rss(pages_dir, targeted, backend):
+    try:
+        output = subprocess.run([sys.executable, "-c", rss_script, pages_dir, "targeted" if targeted else "full", backend],
+                                cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        print(f"Could not measure memory for {backend}: {e.stderr.strip().splitlines()[-1:]}")
+        return None
+    before, after = (int(value) for value in output.stdout.split())
+    return (after - before) / 1024
+
+def bench_scrape(size, folder, results, html_dir=None):
+    import wiki_flags
+    pages = load_saved_pages(html_dir) if html_dir else synthetic_pages(size)
+    case_size = "saved" if html_dir else size
+    html_bytes = sum(len(page) for page in pages.values())
+    pages_dir = os.path.join(folder, "pages")  # The pages as files, for the memory measuring processes
+    os.makedirs(pages_dir, exist_ok=True)
+    for page, html in pages.items():
+        with open(os.path.join(pages_dir, f"{page}.html"), "wb") as file:
+            file.write(html)
+    backends = ["html.parser"] + (["lxml"] if wiki_flags.parser_backend == "lxml" else [])
+    # Whole-page trees (how the pages used to be parsed) against only the parts holding flags
+    for backend in backends:
+        for case, targeted in (("parse_flags_full_tree", False), ("parse_flags", True)):
+            parse = lambda: wiki_flags.parse_flags(pages, targeted, backend)
+            results.append({"stage": "scrape", "case": case, "size": case_size, "parser": backend,
+                            "seconds": measure(parse, repeat=1), "peak_rss_mb": peak_rss(pages_dir, targeted, backend),
+                            "html_bytes": html_bytes})
+
+    frame = wiki_flags.parse_flags(pages)
+    results.append({"stage": "scrape", "case": "clean_flags", "size": case_size, "rows": len(frame),
+                    "seconds": measure(lambda: wiki_flags.clean_flags(frame.copy()))})
+    cleaned = wiki_flags.clean_flags(frame.copy())
+    results.append({"stage": "scrape", "case": "dedupe_flags", "size": case_size, "rows": len(cleaned),
+                    "seconds": measure(lambda: wiki_flags.dedupe_flags(cleaned))})
+
+# Local stand-in for upload.wikimedia.org: serves fixture bytes with an ETag and answers
+# conditional requests with 304, like the real server does
+class FixtureHandler(BaseHTTPRequestHandler):
+    files = {}
+
+    def do_GET(self):
+        body = self.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fixture_server(files):
+    FixtureHandler.files = files
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FixtureHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def bench_download(size, folder, results, count=200, workers=8):
+    import get_images
+    count = min(size, count)
+    svg = ('<svg xmlns="http://www.w3.org/2000/svg" width="900" height="600">'
+           '<rect width="900" height="300" fill="#{:06x}"/><rect y="300" width="900" height="300" fill="#ffffff"/></svg>')
+    files = {f"/flag_{index}.svg": svg.format(index * 2654435761 % 0xFFFFFF).encode() for index in range(count)}
+    server = start_fixture_server(files)
+    base = f"http://127.0.0.1:{server.server_port}"
+    rows = [(f"Flag {index}", base + path) for index, path in enumerate(files)]
+
+    flags_folder = os.path.join(folder, "flags")
+    sources_folder = os.path.join(folder, "flag_sources")
+    manifest = get_images.FlagManifest(os.path.join(folder, "flags_manifest.json"))
+    # At the default per-host rate, like a real refresh against upload.wikimedia.org
+    host_rate = get_images.default_host_rate
+    run = lambda max_age: get_images.download_all(rows, flags_folder, workers, host_rate, manifest=manifest,
+                                                  source_folder=sources_folder, max_age=max_age)
+
+    start = time.perf_counter()
+    first = run(get_images.default_max_age)
+    results.append({"stage": "download", "case": "full_sync", "size": count, "workers": workers, "host_rate": host_rate,
+                    "seconds": time.perf_counter() - start, "failed": len(first["failed"])})
+    # A refresh soon after: every flag was checked within max_age, so nothing is requested
+    start = time.perf_counter()
+    second = run(get_images.default_max_age)
+    results.append({"stage": "download", "case": "no_change_sync", "size": count, "workers": workers, "host_rate": host_rate,
+                    "seconds": time.perf_counter() - start, "unchanged": len(second["unchanged"])})
+    # --max-age 0: one conditional request (answered 304) per flag
+    start = time.perf_counter()
+    third = run(0)
+    results.append({"stage": "download", "case": "revalidate_sync", "size": count, "workers": workers, "host_rate": host_rate,
+                    "seconds": time.perf_counter() - start, "unchanged": len(third["unchanged"])})
+    server.shutdown()
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes, selected, html_dir=None):
+    functions = {"catalog": bench_catalog, "guess": bench_guess, "save": bench_save,
+                 "images": bench_images, "scrape": bench_scrape, "download": bench_download}
+    results = []
+    for stage in selected:
+        for size in sizes:
+            print(f"Running {stage} at {size} flags...", file=sys.stderr)
+            # Progress printed by the code being timed goes to stderr, leaving stdout to the report
+            with tempfile.TemporaryDirectory() as folder, contextlib.redirect_stdout(sys.stderr):
+                try:
+                    if stage == "scrape":
+                        bench_scrape(size, folder, results, html_dir)
+                    else:
+                        functions[stage](size, folder, results)
+                except ImportError as e:
+                    results.append({"stage": stage, "size": size, "skipped": f"missing dependency: {e.name}"})
+                    break
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the scrape, download, load and play hot paths")
+    parser.add_argument("--sizes", default="1000,10000", help="Comma separated catalog sizes, e.g. 1000,10000,100000")
+    parser.add_argument("--stages", default=",".join(stages), help=f"Comma separated stages from {','.join(stages)}")
+    parser.add_argument("--html-dir", help="Folder with saved copies of the Wikipedia pages for the scrape stage "
+                                           "(sovereign_states.html, city_flags.html, dependent_territories.html)")
+    parser.add_argument("--output", help="Write the JSON report here instead of printing it")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = run_benchmarks(sizes, args.stages.split(","), args.html_dir)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from collections import deque
+from urllib.parse import urljoin, urldefrag, urlparse, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from bs4 import BeautifulSoup, SoupStrainer
+import pandas as pd
+import wiki_flags
+
+# Crawls the city flag lists: starts at the "Lists of city flags" page and follows the links to
+# the per-region and per-country sub-lists, where most city flags are, collecting Name,URL rows
+# in the all_flags.csv format. Only the article body is read, so logos and other site images
+# never end up in the rows.
+#
+# A fixed number of pages are fetched at once, with a per-host limit on requests in flight and
+# on request rate. Every URL is crawled once. Progress (pages found, rows from finished pages)
+# is checkpointed to a JSON file, so an interrupted crawl continues where it stopped with --resume.
+#
+# The fetch function is passed in, so the crawler runs the same against Wikipedia, the page
+# cache (--offline) or the fixture site built in (--fixture), which mimics the page structure.
+
+crawl_cache_folder = os.path.join(wiki_flags.cache_folder, 'cities')  # Every crawled page, for revalidation and --offline
+checkpoint_path = os.path.join(wiki_flags.cache_folder, 'city_crawl.json')
+fixture_checkpoint_path = os.path.join(wiki_flags.cache_folder, 'city_crawl_fixture.json')  # Kept apart from the real crawl's
+fixture_port = 8731  # Fixed, so a fixture crawl can be resumed too
+output_path = 'csv/city_flags.csv'
+
+default_workers = 4  # Pages fetched at the same time
+default_per_host = 2  # Requests in flight to a single host
+default_host_rate = 5.0  # Maximum requests per second sent to a single host
+default_max_depth = 3  # Links followed from the start page
+default_checkpoint_every = 20  # Pages crawled between checkpoints
+checkpoint_version = 1
+
+# A link to another city flag list: its title mentions flags and cities (or towns, municipalities)
+sublist_pattern = re.compile(r'(?=.*\bflags?\b)(?=.*\b(?:cit(?:y|ies)|towns?|municipalit(?:y|ies)|communes?)\b)',
+                             re.IGNORECASE)
+content_strainer = SoupStrainer('div', id='mw-content-text')  # The article body, without the site around it
+min_image_width = 20  # Smaller images are icons, not flags
+
+# URL without the fragment, so links to sections of a page count as the page
+def normalize_url(url):
+    return urldefrag(url)[0]
+
+# Name a crawled page is cached under: the readable end of its path plus a hash of the URL
+def page_name_for(url):
+    title = unquote(urlparse(url).path.rsplit('/', 1)[-1])
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', title)[:80] + '_' + hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]
+
+def is_sublist_link(link, page_url):
+    href = link.get('href', '')
+    if not href or '?' in href or 'new' in (link.get('class') or []):  # Edit links and links to missing pages
+        return False
+    url = urljoin(page_url, href)
+    if urlparse(url).netloc != urlparse(page_url).netloc:
+        return False
+    title = unquote(urlparse(url).path.rsplit('/', 1)[-1])
+    if ':' in title:  # Files, categories, special pages
+        return False
+    text = link.get('title') or title.replace('_', ' ')
+    return bool(sublist_pattern.search(text))
+
+# Flags in gallery boxes (named by the caption) and in table rows (named by the first cell with text)
+def page_rows(content, page_url):
+    rows = []
+    for image in content.find_all('img'):
+        width = image.get('width', '')
+        if not image.get('src') or (width.isdigit() and int(width) < min_image_width):
+            continue
+        name = None
+        gallery_box = image.find_parent('li', class_='gallerybox')
+        if gallery_box:
+            caption = gallery_box.find('div', class_='gallerytext')
+            name = caption.get_text(' ', strip=True) if caption else None
+        else:
+            row = image.find_parent('tr')
+            if row:
+                cells = (cell.get_text(' ', strip=True) for cell in row.find_all(['td', 'th']))
+                name = next((text for text in cells if text), None)
+        if name:
+            rows.append((name, urljoin(page_url, image['src'])))
+    return rows
+
+# Parse one list page into its (Name, URL) rows and the links to other lists on it
+def extract_city_list(html, page_url, backend=None):
+    soup = BeautifulSoup(html, backend or wiki_flags.parser_backend, parse_only=content_strainer)
+    content = soup.find('div', id='mw-content-text') or soup
+    links = list(dict.fromkeys(normalize_url(urljoin(page_url, link['href']))
+                               for link in content.find_all('a', href=True) if is_sublist_link(link, page_url)))
+    return page_rows(content, page_url), links
+
+# Per-host limits: at most max_per_host requests in flight to one host, started no faster than
+# requests_per_second
+class HostPoliteness:
+    def __init__(self, max_per_host=default_per_host, requests_per_second=default_host_rate):
+        self.max_per_host = max_per_host
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.slots = {}  # Host -> semaphore limiting requests in flight
+        self.next_start = {}  # Host -> earliest time the next request may start
+        self.lock = threading.Lock()
+
+    def call(self, url, fetch):
+        host = urlparse(url).netloc
+        with self.lock:
+            slot = self.slots.get(host)
+            if slot is None:
+                slot = self.slots[host] = threading.BoundedSemaphore(self.max_per_host)
+        with slot:
+            if self.interval:
+                with self.lock:
+                    now = time.monotonic()
+                    start = max(now, self.next_start.get(host, now))
+                    self.next_start[host] = start + self.interval  # Reserve the start time before releasing the lock
+                if start > now:
+                    time.sleep(start - now)
+            return fetch(url)
+
+# Fetch through the page cache in cache/pages/cities, revalidating copies already there
+def cached_fetcher(folder=crawl_cache_folder, offline=False, session=None):
+    session = session or wiki_flags.create_session()
+
+    def fetch(url):
+        return wiki_flags.fetch_page(session, page_name_for(url), url, folder, offline)
+    return fetch
+
+# Fetch straight from the network, for sites that shouldn't be cached (the fixture site)
+def http_fetcher(session=None):
+    session = session or wiki_flags.create_session()
+
+    def fetch(url):
+        response = session.get(url, timeout=30)
+        response.raise_for_status()
+        return response.content
+    return fetch
+
+class CityFlagCrawler:
+    def __init__(self, fetch, start_url=wiki_flags.city_flags_url, workers=default_workers, max_depth=default_max_depth,
+                 politeness=None, checkpoint=checkpoint_path, checkpoint_every=default_checkpoint_every, resume=False):
+        self.fetch = fetch  # Function taking a URL and returning the page's HTML
+        self.start_url = normalize_url(start_url)
+        self.workers = workers
+        self.max_depth = max_depth
+        self.politeness = politeness or HostPoliteness()
+        self.checkpoint = checkpoint  # None to crawl without checkpoints
+        self.checkpoint_every = checkpoint_every
+        self.seen = {}  # URL -> links followed to reach it, in the order pages were found
+        self.pages = {}  # URL -> rows found on it, for every page crawled
+        self.failed = {}  # URL -> error, for pages that couldn't be fetched or parsed this run
+        if resume:
+            self.load_checkpoint()
+        if not self.seen:
+            self.seen[self.start_url] = 0
+
+    def load_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return
+        with open(self.checkpoint, mode='r', encoding='utf-8') as file:
+            state = json.load(file)
+        if state.get('version') != checkpoint_version or state.get('start_url') != self.start_url:
+            print(f"Ignoring checkpoint {self.checkpoint}: it is for a different crawl")
+            return
+        self.seen = {url: depth for url, depth in state['seen']}
+        self.pages = {url: [tuple(row) for row in rows] for url, rows in state['pages'].items()}
+
+    # Written to a temporary file and renamed, so an interrupted write leaves the last checkpoint
+    def save_checkpoint(self):
+        if not self.checkpoint:
+            return
+        os.makedirs(os.path.dirname(self.checkpoint) or ".", exist_ok=True)
+        state = {'version': checkpoint_version, 'start_url': self.start_url,
+                 'seen': list(self.seen.items()), 'pages': self.pages}
+        temp_path = self.checkpoint + '.tmp'
+        with open(temp_path, mode='w', encoding='utf-8') as file:
+            json.dump(state, file, ensure_ascii=False)
+        os.replace(temp_path, self.checkpoint)
+
+    # Crawl every page not crawled yet, yielding (url, rows) as each one finishes. Pages that
+    # failed are left out and tried again by the next run.
+    def crawl(self):
+        pending = deque(url for url in self.seen if url not in self.pages)
+        self.failed = {}
+        since_checkpoint = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                running = {}  # Future -> URL; never more than workers, the rest wait in pending
+                while pending or running:
+                    while pending and len(running) < self.workers:
+                        url = pending.popleft()
+                        running[executor.submit(self.politeness.call, url, self.fetch)] = url
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        url = running.pop(future)
+                        try:
+                            rows, links = extract_city_list(future.result(), url)
+                        except Exception as e:
+                            print(f"Failed to crawl {url}: {e}")
+                            self.failed[url] = str(e)
+                            continue
+                        self.pages[url] = rows
+                        depth = self.seen[url]
+                        if depth < self.max_depth:
+                            for link in links:
+                                if link not in self.seen:
+                                    self.seen[link] = depth + 1
+                                    pending.append(link)
+                        since_checkpoint += 1
+                        if since_checkpoint >= self.checkpoint_every:
+                            self.save_checkpoint()
+                            since_checkpoint = 0
+                        yield url, rows
+        finally:
+            self.save_checkpoint()  # Also when interrupted, so --resume picks up from here
+
+    # Every row found so far, in the order the pages were found, each (Name, URL) pair once
+    def rows(self):
+        return list(dict.fromkeys(row for url in self.seen for row in self.pages.get(url, ())))
+
+    def frame(self):
+        return pd.DataFrame(self.rows(), columns=['Name', 'URL'])
+
+# Crawl the city flag lists and return the uncleaned rows as a DataFrame (the city_flags page
+# frame for wiki_flags.parse_flags), or None if any list failed, since the rows would be incomplete
+def crawl_city_flags(start_url=wiki_flags.city_flags_url, folder=crawl_cache_folder, offline=False, resume=False,
+                     workers=default_workers, max_depth=default_max_depth, checkpoint=checkpoint_path):
+    crawler = CityFlagCrawler(cached_fetcher(folder, offline), start_url, workers, max_depth,
+                              checkpoint=checkpoint, resume=resume)
+    for _ in crawler.crawl():
+        pass
+    print(f"Crawled {len(crawler.pages)} city flag lists ({len(crawler.failed)} failed), {len(crawler.rows())} flags.")
+    return None if crawler.failed else crawler.frame()
+
+# Fixture site shaped like the Wikipedia lists: an index linking to regions and a few countries
+# directly, regions linking to countries, and country pages with cities in galleries or tables.
+# Pages have a logo and navigation around the article and links that must not be followed.
+# Returns (path -> HTML, names of every city flag on the site).
+def fixture_site(countries=40, cities=25, regions=4, seed=0):
+    rng = random.Random(seed)
+    syllables = ["ba", "lo", "mar", "ten", "vi", "sa", "ko", "ri", "del", "an", "por", "zu", "ne", "gra", "li"]
+    city_names = set()
+    while len(city_names) < countries * cities:
+        city_names.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).capitalize())
+    city_names = sorted(city_names)
+    rng.shuffle(city_names)
+
+    def page(title, body):
+        return (f'<html><head><title>{title} - Wikipedia</title></head><body>'
+                f'<div id="mw-navigation"><img src="/static/images/logo.png" width="160" alt="Wikipedia">'
+                f'<a href="/wiki/Main_Page" title="Main Page">Main page</a>'
+                f'<a href="/wiki/Special:Random">Random article</a></div>'
+                f'<div id="mw-content-text" class="mw-body-content"><div class="mw-parser-output">{body}</div></div>'
+                f'<div id="footer"><img src="/static/images/poweredby_mediawiki.svg" width="88" alt="Powered by MediaWiki">'
+                f'</div></body></html>').encode('utf-8')
+
+    def link(path, title, text=None):
+        return f'<a href="/wiki/{path}" title="{title}">{text or title}</a>'
+
+    def image(name):
+        file_name = f"Flag_of_{name}.svg"
+        return (f'<img src="//upload.wikimedia.org/wikipedia/commons/thumb/a/ab/{file_name}/120px-{file_name}.png" '
+                f'width="120" height="80" alt="">')
+
+    pages = {}
+    country_paths = [f"List_of_city_flags_in_Country_{index}" for index in range(countries)]
+    region_paths = [f"Lists_of_city_flags_in_Region_{index}" for index in range(regions)]
+    for index, path in enumerate(country_paths):
+        names = city_names[index * cities:(index + 1) * cities]
+        if index % 2:
+            body = '<ul class="gallery">' + "".join(
+                f'<li class="gallerybox">{image(name)}<div class="gallerytext">{link(name, name)}, Country {index}</div></li>'
+                for name in names) + '</ul>'
+        else:
+            body = ('<table class="wikitable"><tr><th>Flag</th><th>City</th><th>Adopted</th></tr>' + "".join(
+                f'<tr><td>{image(name)}</td><td>{link(name, name)}</td><td>{1900 + rng.randrange(120)}</td></tr>'
+                for name in names) + '</table>')
+        neighbour = country_paths[(index + 1) % countries]
+        body += (f'<p><img src="/static/images/icons/edit.svg" width="12"> See also: '
+                 f'{link(neighbour, neighbour.replace("_", " "))}, {link("Lists_of_city_flags#Europe", "Lists of city flags")}, '
+                 f'<a href="/w/index.php?title=List_of_city_flags_in_Atlantis&action=edit&redlink=1" class="new" '
+                 f'title="List of city flags in Atlantis (page does not exist)">Atlantis</a>, '
+                 f'{link("File:Flag_of_cities.svg", "File:Flag of cities.svg")}</p>')
+        pages[f"/wiki/{path}"] = page(path.replace("_", " "), body)
+    for index, path in enumerate(region_paths):
+        body = "<ul>" + "".join(f"<li>{link(country, country.replace('_', ' '), country.rsplit('_', 2)[-2] + ' ' + country.rsplit('_', 1)[-1])}</li>"
+                                for country in country_paths[index::regions]) + "</ul>"
+        pages[f"/wiki/{path}"] = page(path.replace("_", " "), body)
+    index_body = ("<p>Flags of cities are a part of " + link("Vexillology", "Vexillology") + ".</p><ul>"
+                  + "".join(f"<li>{link(path, path.replace('_', ' '))}</li>" for path in region_paths)
+                  + "".join(f"<li>{link(path, path.replace('_', ' '))}</li>" for path in country_paths[:3])
+                  + "</ul>")
+    pages["/wiki/Lists_of_city_flags"] = page("Lists of city flags", index_body)
+    return pages, city_names
+
+# Serve the fixture pages on a local port (with an optional delay per request, like a slow
+# network); returns the server and the URL of the index page
+def serve_fixture(pages, delay=0.0, host="127.0.0.1", port=0):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if delay:
+                time.sleep(delay)
+            body = pages.get(self.path)
+            self.send_response(200 if body else 404)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, format, *args):
+            pass  # Keep the crawl output readable
+
+    server = ThreadingHTTPServer((host, port), FixtureHandler)
+    threading.Thread(target=server.serve_forever, name="fixture-site", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/wiki/Lists_of_city_flags"
+
+def add_arguments(parser):
+    parser.add_argument("--start-url", default=wiki_flags.city_flags_url, help="Page the crawl starts from")
+    parser.add_argument("--workers", type=int, default=default_workers, help="Pages fetched at the same time")
+    parser.add_argument("--per-host", type=int, default=default_per_host, help="Requests in flight to a single host")
+    parser.add_argument("--host-rate", type=float, default=default_host_rate,
+                        help="Maximum requests per second per host (0 disables the limit)")
+    parser.add_argument("--max-depth", type=int, default=default_max_depth, help="Links followed from the start page")
+    parser.add_argument("--cache-dir", default=crawl_cache_folder, help="Folder for cached copies of the crawled pages")
+    parser.add_argument("--offline", action="store_true", help="Crawl the cached pages without using the network")
+    parser.add_argument("--checkpoint", help=f"File the crawl's progress is saved to (default: {checkpoint_path})")
+    parser.add_argument("--resume", action="store_true", help="Continue the crawl saved in the checkpoint")
+    parser.add_argument("--output", help=f"CSV file to write, Name,URL like all_flags.csv (default: {output_path}, "
+                                         "or nothing for --fixture)")
+    parser.add_argument("--fixture", type=int, metavar="COUNTRIES",
+                        help="Crawl a local fixture site with this many country lists instead, and check the result")
+    parser.add_argument("--fixture-delay", type=float, default=0.02, help="Seconds the fixture site takes per page")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Crawl the city flag lists on Wikipedia into Name,URL rows")
+    add_arguments(parser)
+    return parser.parse_args()
+
+def run(args):
+    politeness = HostPoliteness(args.per_host, args.host_rate)
+    server = None
+    if args.fixture:
+        pages, city_names = fixture_site(args.fixture)
+        server, start_url = serve_fixture(pages, args.fixture_delay, port=fixture_port)
+        fetch = http_fetcher()
+        checkpoint = args.checkpoint or fixture_checkpoint_path
+        output = args.output
+    else:
+        start_url = args.start_url
+        fetch = cached_fetcher(args.cache_dir, args.offline)
+        checkpoint = args.checkpoint or checkpoint_path
+        output = args.output or output_path
+
+    crawler = CityFlagCrawler(fetch, start_url, args.workers, args.max_depth, politeness, checkpoint, resume=args.resume)
+    start = time.perf_counter()
+    try:
+        for url, rows in crawler.crawl():
+            print(f"  {len(rows):4d} flags  {unquote(urlparse(url).path)}")
+    except KeyboardInterrupt:
+        print(f"Interrupted; run again with --resume to continue from {checkpoint}")
+        return
+    finally:
+        if server:
+            server.shutdown()
+    elapsed = time.perf_counter() - start
+
+    all_flags_df = wiki_flags.clean_flags(crawler.frame())
+    print(f"Crawled {len(crawler.pages)} pages ({len(crawler.failed)} failed) in {elapsed:.1f}s, {len(all_flags_df)} flags.")
+    if output and crawler.failed:
+        print(f"Not writing '{output}' because {len(crawler.failed)} pages failed; run again with --resume to retry them.")
+    elif output:
+        wiki_flags.save_flags(all_flags_df, output)
+        print(f"Data has been saved to '{output}'.")
+    if args.fixture:
+        found = set(all_flags_df['Name'])
+        missing = [name for name in city_names if name not in found]
+        extra = sorted(found - set(city_names))
+        print(f"Fixture check: {len(city_names) - len(missing)} of {len(city_names)} cities found, "
+              f"{len(extra)} unexpected rows{': ' + ', '.join(extra[:5]) if extra else ''}.")
+
+def main():
+    run(parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import io
+import os
+import json
+import hashlib
+import mmap
+import shutil
+import struct
+import argparse
+from PIL import Image
+
+# Single file holding every flag at a few display sizes, so the game can memory-map it and
+# pick the size that suits the window instead of opening and resizing a PNG for each question.
+#
+# Layout: header (magic, version, index length), JSON index, then the image data starting at the
+# next aligned offset. The index maps flag name -> list of [offset, length, width, height], one per
+# size, smallest first, with offsets relative to the start of the image data. Each size is stored
+# compressed (lossless WebP or PNG), which for flat-coloured flags is a fraction of the raw pixels.
+# Identical files are stored once.
+bundle_path = "flags.bundle"
+flags_folder = "flags"
+display_size = (300, 150)  # Box the game shows flags in at its default window size
+
+# Boxes every flag is rendered into by rasterize.py. Flags keep their own shape and are scaled to
+# fit inside the box, so at 300x150 a square flag is 150x150 and Nepal is 123x150.
+variant_sizes = [(150, 75), (300, 150), (480, 240), (720, 360)]
+variants_folder = "sizes"  # Sizes other than display_size: <flags folder>/sizes/<W>x<H>/<flag>.webp
+variant_format = "WEBP"
+
+magic = b"FLAGBNDL"
+version = 2
+header_format = "<8sII"  # Magic, version, index length in bytes
+alignment = 16  # Data for every image starts on an aligned offset
+
+def align(offset):
+    return (offset + alignment - 1) // alignment * alignment
+
+# Largest size that fits inside box without changing the image's shape
+def fit_size(size, box):
+    width, height = size
+    scale = min(box[0] / width, box[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+# Largest of the rendered boxes that fits in the space available, or the smallest if none does
+def variant_box_for(space, sizes=variant_sizes):
+    fitting = [box for box in sizes if box[0] <= space[0] and box[1] <= space[1]]
+    return max(fitting) if fitting else min(sizes)
+
+# Where the image for one box lives, given the flag's display PNG
+def variant_path_for(output_path, box):
+    if tuple(box) == display_size:
+        return output_path
+    folder, filename = os.path.split(output_path)
+    return os.path.join(folder, variants_folder, f"{box[0]}x{box[1]}", os.path.splitext(filename)[0] + ".webp")
+
+def variant_paths_for(output_path, sizes=variant_sizes):
+    return [variant_path_for(output_path, box) for box in sizes]
+
+# Compressed bytes of one image fitted into box: the file as it is when it already fits and is
+# compressed losslessly, otherwise resized and encoded again
+def encode_variant(path, box):
+    with Image.open(path) as img:
+        if img.format in ('PNG', 'WEBP') and img.width <= box[0] and img.height <= box[1]:
+            with open(path, "rb") as file:
+                return img.size, file.read()
+        img = img.convert("RGBA")
+        if img.getextrema()[3][0] == 255:  # Fully opaque, no need to keep the alpha channel
+            img = img.convert("RGB")
+        img = img.resize(fit_size(img.size, box), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format=variant_format, lossless=True)
+        return img.size, buffer.getvalue()
+
+# Pack every flag in the folder, at every size rendered for it, into one bundle file; returns the
+# number of flags packed. Images are streamed to a scratch file so memory use stays flat.
+def build_bundle(folder=flags_folder, path=bundle_path, sizes=variant_sizes):
+    index = {}
+    stored = {}  # Hash of an image file -> index entry already written for it
+    data_path = path + ".data"
+    with open(data_path, "w+b") as data_file:
+        for filename in sorted(os.listdir(folder)):
+            flag_name, extension = os.path.splitext(filename)
+            if extension.lower() not in ('.png', '.jpg', '.jpeg'):
+                continue
+            base_path = os.path.join(folder, filename)
+            entries = []
+            for box in sizes:
+                variant_path = variant_path_for(base_path, box)
+                if not os.path.exists(variant_path):
+                    if tuple(box) != display_size:
+                        continue  # Rendered before variants existed; the display size is fitted from the PNG
+                    variant_path = base_path
+                try:
+                    (width, height), data = encode_variant(variant_path, box)
+                except Exception as e:
+                    print(f"Failed to pack {variant_path}: {e}")
+                    continue
+                key = hashlib.sha256(data).digest()
+                if key not in stored:
+                    offset = align(data_file.tell())
+                    data_file.write(b"\0" * (offset - data_file.tell()))  # Padding up to the aligned offset
+                    data_file.write(data)
+                    stored[key] = [offset, len(data)]
+                entries.append(stored[key] + [width, height])
+            if entries:
+                index[flag_name] = sorted(entries, key=lambda entry: entry[2] * entry[3])
+
+        index_bytes = json.dumps(index, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        header_length = struct.calcsize(header_format) + len(index_bytes)
+
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as file:
+            file.write(struct.pack(header_format, magic, version, len(index_bytes)))
+            file.write(index_bytes)
+            file.write(b"\0" * (align(header_length) - header_length))
+            data_file.seek(0)
+            shutil.copyfileobj(data_file, file)
+    os.remove(data_path)
+    os.replace(temp_path, path)
+    return len(index)
+
+# Open an image and make sure it fits in box, shrinking it (shape kept) if it doesn't
+def fitted_image(source, box):
+    img = Image.open(source)
+    if img.width > box[0] or img.height > box[1]:
+        img = img.resize(fit_size(img.size, box), Image.LANCZOS)
+    img.load()  # Decode now, so it happens on whichever thread asked for the image
+    return img
+
+# Read-only view of a bundle file
+class FlagBundle:
+    def __init__(self, path=bundle_path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, file_version, index_length = struct.unpack_from(header_format, self.map, 0)
+        if file_magic != magic or file_version != version:
+            self.map.close()
+            self.file.close()
+            raise ValueError(f"{path} is not a version {version} flag bundle")
+        index_start = struct.calcsize(header_format)
+        self.index = json.loads(self.map[index_start:index_start + index_length].decode('utf-8'))
+        self.data_start = align(index_start + index_length)
+        self.view = memoryview(self.map)
+
+    def names(self):
+        return list(self.index)
+
+    def __contains__(self, flag_name):
+        return flag_name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    # (width, height) of every size stored for a flag, smallest first
+    def sizes(self, flag_name):
+        return [(width, height) for _, _, width, height in self.index[flag_name]]
+
+    # The flag at the largest stored size that fits in box (or the smallest, shrunk to fit), so
+    # only a small image is ever decoded
+    def get_image(self, flag_name, box=display_size):
+        entries = self.index[flag_name]
+        fitting = [entry for entry in entries if entry[2] <= box[0] and entry[3] <= box[1]]
+        offset, length, width, height = fitting[-1] if fitting else entries[0]
+        offset += self.data_start
+        return fitted_image(io.BytesIO(self.view[offset:offset + length]), box)
+
+    def close(self):
+        self.view = None
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # A view handed out earlier is still alive; the mapping is freed with it
+        self.file.close()
+
+# Image for one flag fitted into box, from the bundle when it has it, otherwise from the rendered
+# size closest to box in the flags folder
+def load_flag_image(flag_name, bundle=None, folder=flags_folder, box=display_size):
+    if bundle and flag_name in bundle:
+        return bundle.get_image(flag_name, box)
+    base_path = os.path.join(folder, f"{flag_name}.png")
+    path = variant_path_for(base_path, variant_box_for(box))
+    return fitted_image(path if os.path.exists(path) else base_path, box)
+
+def add_arguments(parser):
+    parser.add_argument("--flags-folder", default=flags_folder, help="Folder with the rendered flag images")
+    parser.add_argument("--output", default=bundle_path, help="Bundle file to write")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pack the rendered flag images, at every size, into a single bundle file")
+    add_arguments(parser)
+    return parser.parse_args()
+
+def run(args):
+    count = build_bundle(args.flags_folder, args.output)
+    print(f"Packed {count} flags into {args.output}.")
+
+def main():
+    run(parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import os
+import csv
+import pickle
+import random
+from array import array
+from answer_registry import journal_path_for, read_answers_csv, replay_journal
+
+# One flag and the alternative answers read from valid_answers.csv. Answers are a tuple so a
+# loaded catalog can be shared (between games, threads or server sessions) without copying.
+class FlagRecord:
+    __slots__ = ("name", "answers", "has_image")
+
+    def __init__(self, name, answers, has_image):
+        self.name = name
+        self.answers = answers
+        self.has_image = has_image
+
+# Every known flag, loaded once from valid_answers.csv and the flag images. Never changes after
+# loading; answers registered during play go into a CatalogOverlay instead.
+class FlagCatalog:
+    def __init__(self, records):
+        self.records = {record.name: record for record in records}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, flag_name):
+        return flag_name in self.records
+
+    # Flags that can be shown as a question (valid_answers.csv may list flags whose image is gone)
+    def playable_names(self):
+        return [name for name, record in self.records.items() if record.has_image]
+
+    def answers(self, flag_name):
+        record = self.records.get(flag_name)
+        return record.answers if record else ()
+
+    def items(self):
+        for name, record in self.records.items():
+            yield name, record.answers
+
+    def overlay(self):
+        return CatalogOverlay(self)
+
+# Copy-on-write view of a catalog: reads fall through to the shared catalog, and only flags that
+# get new answers are copied into the overlay
+class CatalogOverlay:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.added = {}  # Flag name -> answers tuple including the newly registered ones
+
+    def __len__(self):
+        return len(self.catalog) + sum(1 for name in self.added if name not in self.catalog)
+
+    def __contains__(self, flag_name):
+        return flag_name in self.added or flag_name in self.catalog
+
+    def answers(self, flag_name):
+        if flag_name in self.added:
+            return self.added[flag_name]
+        return self.catalog.answers(flag_name)
+
+    def register(self, flag_name, answer):
+        answers = self.answers(flag_name)
+        if answer not in answers:
+            self.added[flag_name] = answers + (answer,)
+
+    def items(self):
+        for name, answers in self.catalog.items():
+            yield name, self.added.get(name, answers)
+        for name, answers in self.added.items():
+            if name not in self.catalog:
+                yield name, answers
+
+    def playable_names(self):
+        return self.catalog.playable_names()
+
+# Pre-shuffled question order. Drawing takes the last card and removing an arbitrary flag swaps
+# it with the last card, so both are O(1) however many flags are left.
+class FlagDeck:
+    def __init__(self, names, rng=None):
+        self.cards = list(names)
+        (rng or random).shuffle(self.cards)
+        self.positions = {name: index for index, name in enumerate(self.cards)}
+
+    def __len__(self):
+        return len(self.cards)
+
+    def __contains__(self, flag_name):
+        return flag_name in self.positions
+
+    def draw(self):
+        flag_name = self.cards.pop()
+        del self.positions[flag_name]
+        return flag_name
+
+    # The next few flags draw() will return, in order, without removing them
+    def peek(self, count):
+        return self.cards[:-count - 1:-1] if count > 0 else []
+
+    def remove(self, flag_name):
+        index = self.positions.pop(flag_name)
+        last = self.cards.pop()
+        if index < len(self.cards):
+            self.cards[index] = last
+            self.positions[last] = index
+
+# Question order for many games at once over one shared list of names (the game server). Each
+# game keeps 4-byte indexes into the list instead of its own names and position dict, and the
+# shuffle is done lazily (Fisher-Yates from the end), so starting a game costs almost nothing.
+# Same draw/peek interface as FlagDeck, without remove.
+class CompactDeck:
+    def __init__(self, names, rng=None):
+        self.names = names
+        self.rng = rng or random
+        self.order = array('I', range(len(names)))
+        self.settled = 0  # Cards at the end of order already in their final shuffled place
+
+    def __len__(self):
+        return len(self.order)
+
+    # Shuffle the last count cards into place
+    def settle(self, count):
+        order = self.order
+        while self.settled < min(count, len(order)):
+            i = len(order) - 1 - self.settled
+            j = self.rng.randrange(i + 1)
+            order[i], order[j] = order[j], order[i]
+            self.settled += 1
+
+    def draw(self):
+        self.settle(1)
+        self.settled -= 1
+        return self.names[self.order.pop()]
+
+    def peek(self, count):
+        if count <= 0:
+            return []
+        self.settle(count)
+        return [self.names[index] for index in self.order[:-count - 1:-1]]
+
+# Groups of flags that look the same, written by flag_duplicates.py next to valid_answers.csv
+def groups_path_for(answers_file):
+    return os.path.join(os.path.dirname(answers_file), "flag_groups.csv")
+
+def read_flag_groups(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, mode='r', encoding='utf-8') as file:
+        return [[name.strip() for name in row if name.strip()] for row in csv.reader(file) if len(row) > 1]
+
+# Turn each group into one question: the first flag with an image is asked and accepts the
+# names and answers of the others, which are no longer asked themselves
+def merge_flag_groups(records, groups):
+    for group in groups:
+        members = [records[name] for name in group if name in records]
+        asked = next((record for record in members if record.has_image), None)
+        if asked is None:
+            continue
+        answers = list(asked.answers)
+        for record in members:
+            if record is not asked:
+                answers.append(record.name)
+                answers.extend(record.answers)
+                record.has_image = False
+        asked.answers = tuple(dict.fromkeys(answers))
+
+catalog_cache_version = 1  # Bump when the cached catalog format changes
+
+# Size and modification time of everything the catalog is built from, so a cached catalog is
+# only reused while none of them has changed (adding or removing a flag image changes the folder)
+def catalog_fingerprint(folder, answers_file, bundle=None):
+    fingerprint = [catalog_cache_version]
+    for path in (answers_file, journal_path_for(answers_file), groups_path_for(answers_file),
+                 bundle.path if bundle else folder):
+        try:
+            stat = os.stat(path)
+            fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append((path, None, None))
+    return fingerprint
+
+def read_catalog_cache(cache_path, fingerprint):
+    try:
+        with open(cache_path, "rb") as file:
+            cached_fingerprint, rows = pickle.load(file)
+    except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+        return None
+    if cached_fingerprint != fingerprint:
+        return None
+    return FlagCatalog(FlagRecord(*row) for row in rows)
+
+def write_catalog_cache(cache_path, fingerprint, catalog):
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    rows = [(record.name, record.answers, record.has_image) for record in catalog.records.values()]
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "wb") as file:
+        pickle.dump((fingerprint, rows), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, cache_path)
+
+# Read valid_answers.csv and the available flag images once and build the catalog. With a
+# cache_path the built catalog is saved there and reused until one of its inputs changes.
+def load_flags(folder, answers_file, bundle=None, cache_path=None):
+    # Check if the valid_answers.csv file exists; if not, create it
+    if not os.path.exists(answers_file):
+        os.makedirs(os.path.dirname(answers_file) or ".", exist_ok=True)
+        open(answers_file, mode='w', encoding='utf-8', newline='').close()
+
+    if cache_path:
+        fingerprint = catalog_fingerprint(folder, answers_file, bundle)
+        catalog = read_catalog_cache(cache_path, fingerprint)
+        if catalog is not None:
+            return catalog
+
+    # Load valid answers from the CSV file, plus any registered since it was last compacted
+    answers = replay_journal(journal_path_for(answers_file), read_answers_csv(answers_file))
+
+    # Load flag names from the bundle index, or from the folder if there is no bundle
+    if bundle:
+        image_names = set(bundle.names())
+    elif os.path.isdir(folder):
+        image_names = {os.path.splitext(filename)[0] for filename in os.listdir(folder)
+                       if filename.endswith(('.png', '.jpg', '.jpeg'))}
+    else:
+        image_names = set()
+
+    records = [FlagRecord(flag_name, flag_answers, flag_name in image_names)
+               for flag_name, flag_answers in answers.items()]
+    for flag_name in sorted(image_names - answers.keys()):
+        records.append(FlagRecord(flag_name, (flag_name,), True))  # Initialize with the flag name if not found
+
+    catalog = FlagCatalog(records)
+    merge_flag_groups(catalog.records, read_flag_groups(groups_path_for(answers_file)))
+    if cache_path:
+        try:
+            write_catalog_cache(cache_path, fingerprint, catalog)
+        except OSError as e:
+            print(f"Failed to cache the catalog in {cache_path}: {e}")
+    return catalog
@@ -0,0 +1,160 @@
+import os
+import csv
+import argparse
+from PIL import Image
+from flag_bundle import FlagBundle, load_flag_image, bundle_path, flags_folder
+from flag_catalog import groups_path_for
+
+# Finds flags that look the same (the same picture under several names, or copies that differ
+# only in compression or a few pixels) and writes them to flag_groups.csv, one group per line.
+# The game asks each group as one question that accepts the name of any flag in it.
+#
+# Each flag gets a difference hash per colour channel in both directions: the image is shrunk to
+# 9x8 and every bit says whether a pixel is brighter than its right-hand neighbour, then to 8x9
+# for whether it is brighter than the pixel below. The vertical bits are what tell horizontally
+# striped flags apart (Germany, Russia, Austria); the horizontal ones do the same for vertical
+# stripes. Gradients ignore flat colour, so two flags also need close average colours in every cell
+# of a 4x4 grid to match (a plain red flag and a plain blue one have the same, empty, gradients,
+# and France and Italy only differ in colour).
+
+default_answers_path = "csv/valid_answers.csv"
+hash_width = 9
+hash_height = 8
+channel_bits = (hash_width - 1) * hash_height
+hash_bits = channel_bits * 3 * 2  # Both directions for each of the three channels
+colour_grid = (4, 4)
+default_max_distance = 12  # Bits (out of hash_bits) two flags may differ by and still be grouped
+default_max_colour_difference = 40  # Largest difference (0-255) of any channel in any grid cell
+
+# Bits for every channel of the image, comparing each pixel with the next one across (or down)
+def gradient_bits(img, value=0, vertical=False):
+    size = (hash_height, hash_width) if vertical else (hash_width, hash_height)
+    small = img.resize(size, Image.LANCZOS)
+    width = size[0]
+    step = width if vertical else 1  # Distance to the neighbour being compared in the pixel bytes
+    for channel in small.split():
+        pixels = channel.tobytes()
+        for y in range(size[1] - (1 if vertical else 0)):
+            for x in range(width - (0 if vertical else 1)):
+                index = y * width + x
+                value = (value << 1) | (pixels[index] > pixels[index + step])
+    return value
+
+def difference_hash(img):
+    img = img.convert("RGB")
+    return gradient_bits(img, gradient_bits(img), vertical=True)
+
+# (difference hash, bytes of the 4x4 RGB colour grid) for one flag
+def flag_signature(img):
+    img = img.convert("RGB")
+    return difference_hash(img), img.resize(colour_grid, Image.BOX).tobytes()
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+def colour_difference(a, b):
+    return max(abs(x - y) for x, y in zip(a, b))
+
+# Pairs of flags whose hashes differ by at most max_distance bits and whose colours are close, as
+# (distance, a, b). The hash is cut into max_distance + 1 bands; two hashes that close must agree
+# exactly on at least one band, so only flags sharing a band value are compared.
+def near_duplicate_pairs(signatures, max_distance=default_max_distance, max_colour_difference=default_max_colour_difference):
+    bands = max_distance + 1
+    band_bits = -(-hash_bits // bands)
+    buckets = {}
+    for flag_name, (value, _) in signatures.items():
+        for band in range(bands):
+            key = (band, (value >> (band * band_bits)) & ((1 << band_bits) - 1))
+            buckets.setdefault(key, []).append(flag_name)
+
+    pairs = {}
+    checked = set()
+    for names in buckets.values():
+        for i, a in enumerate(names):
+            for b in names[i + 1:]:
+                if (a, b) in checked:
+                    continue
+                checked.add((a, b))
+                (hash_a, colours_a), (hash_b, colours_b) = signatures[a], signatures[b]
+                distance = hamming_distance(hash_a, hash_b)
+                if distance <= max_distance and colour_difference(colours_a, colours_b) <= max_colour_difference:
+                    pairs[(a, b)] = distance
+    return sorted((distance, a, b) for (a, b), distance in pairs.items())
+
+# Join pairs into groups, closest pairs first, only where every flag in the merged group is
+# within the distance of every other one. Pairs aren't chained: A like B and B like C doesn't put
+# A and C together unless A is like C too.
+def group_pairs(pairs):
+    matching = {frozenset((a, b)) for _, a, b in pairs}
+    group_of = {}  # Flag name -> the list of names in its group
+    for distance, a, b in pairs:
+        group_a = group_of.get(a, [a])
+        group_b = group_of.get(b, [b])
+        if group_a is group_b:
+            continue
+        if all(frozenset((x, y)) in matching for x in group_a for y in group_b):
+            merged = group_a + group_b
+            for name in merged:
+                group_of[name] = merged
+    groups = {id(group): group for group in group_of.values()}
+    return sorted(sorted(names) for names in groups.values())
+
+def hash_flags(names, bundle=None, folder=flags_folder):
+    signatures = {}
+    for flag_name in names:
+        try:
+            signatures[flag_name] = flag_signature(load_flag_image(flag_name, bundle, folder))
+        except Exception as e:
+            print(f"Failed to hash {flag_name}: {e}")
+    return signatures
+
+def write_groups(path, groups):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, mode='w', encoding='utf-8', newline='') as file:
+        csv.writer(file).writerows(groups)
+    os.replace(temp_path, path)
+
+def print_report(pairs, groups):
+    print(f"{len(groups)} groups of near-identical flags ({len(pairs)} pairs):")
+    distances = {(a, b): distance for distance, a, b in pairs}
+    for names in groups:
+        closest = min(distance for (a, b), distance in distances.items() if a in names)
+        print(f"  {' / '.join(names)}  (distance {closest})")
+
+def add_arguments(parser):
+    parser.add_argument("--flags-folder", default=flags_folder, help="Folder with the display PNGs")
+    parser.add_argument("--bundle", default=bundle_path, help="Flag bundle to read images from, if it exists")
+    parser.add_argument("--output", default=groups_path_for(default_answers_path), help="Groups file to write")
+    parser.add_argument("--max-distance", type=int, default=default_max_distance,
+                        help=f"Differing hash bits (out of {hash_bits}) still counted as the same flag")
+    parser.add_argument("--max-colour-difference", type=int, default=default_max_colour_difference,
+                        help="Colour difference (0-255) in any part of the flag still counted as the same flag")
+    parser.add_argument("--report-only", action="store_true", help="Print the groups without writing them")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Report flags that look the same and group them into one question")
+    add_arguments(parser)
+    return parser.parse_args()
+
+def run(args):
+    bundle = FlagBundle(args.bundle) if os.path.exists(args.bundle) else None
+    if bundle:
+        names = bundle.names()
+    else:
+        names = sorted(os.path.splitext(filename)[0] for filename in os.listdir(args.flags_folder)
+                       if filename.endswith(('.png', '.jpg', '.jpeg')))
+
+    signatures = hash_flags(names, bundle, args.flags_folder)
+    pairs = near_duplicate_pairs(signatures, args.max_distance, args.max_colour_difference)
+    groups = group_pairs(pairs)
+    print_report(pairs, groups)
+    if not args.report_only:
+        write_groups(args.output, groups)
+        print(f"Groups have been saved to '{args.output}'.")
+
+def main():
+    run(parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import time
+import random
+import argparse
+from flag_stats import FlagStats
+
+# Chooses the order flags are asked in. Every flag gets a weight from the player's stats and is
+# drawn with probability proportional to it, still once per game. The weights live in a Fenwick
+# tree, so drawing a flag (sampling and then zeroing its weight) is O(log n) however big the
+# catalog is, and building the order for a new game is a single O(n) pass.
+#
+# Modes:
+#   uniform  every flag equally likely (the same as shuffling)
+#   weakest  flags answered wrongly most often come first; unseen flags count as half right
+#   spaced   spaced repetition: a flag is due again after a gap that doubles with every correct
+#            answer in a row; overdue and never-seen flags are likely, ones not yet due are rare
+
+modes = ["uniform", "weakest", "spaced"]
+min_weight = 1e-3  # Every flag keeps some chance, so each one is still asked once per game
+spaced_base_interval = 3600.0  # Seconds before a flag answered correctly once is due again
+not_due_weight = 0.05  # Weight of a flag that isn't due yet, scaled by how close it is
+
+# Prefix sums over a list of weights with O(log n) update and search
+class FenwickTree:
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.weights = list(weights)
+        tree = [0.0] + self.weights
+        for i in range(1, self.size + 1):
+            parent = i + (i & -i)
+            if parent <= self.size:
+                tree[parent] += tree[i]
+        self.tree = tree
+        self.total = sum(self.weights)
+        self.top_bit = 1 << (self.size.bit_length() - 1) if self.size else 0
+
+    def set(self, index, weight):
+        delta = weight - self.weights[index]
+        self.weights[index] = weight
+        self.total += delta
+        i = index + 1
+        while i <= self.size:
+            self.tree[i] += delta
+            i += i & -i
+
+    # Index of the first weight whose prefix sum passes value
+    def find(self, value):
+        position = 0
+        bit = self.top_bit
+        while bit:
+            following = position + bit
+            if following <= self.size and self.tree[following] <= value:
+                position = following
+                value -= self.tree[following]
+            bit >>= 1
+        return position
+
+# Question order drawn by weight without replacement. Same draw/peek interface as FlagDeck.
+class WeightedDeck:
+    def __init__(self, names, weights, rng=None):
+        self.names = names
+        self.rng = rng or random
+        self.tree = FenwickTree([max(weight, min_weight) for weight in weights])
+        self.remaining = len(names)
+        self.upcoming = []  # Indexes already drawn by peek, in the order draw will return them
+
+    def __len__(self):
+        return self.remaining
+
+    def sample(self):
+        tree = self.tree
+        index = tree.find(self.rng.random() * tree.total)
+        if index >= tree.size or tree.weights[index] == 0:
+            # Rounding left the total slightly off; recount it and take the last flag with weight
+            tree.total = sum(tree.weights)
+            index = max(i for i in range(tree.size) if tree.weights[i] > 0)
+        tree.set(index, 0.0)
+        return index
+
+    def draw(self):
+        if not self.remaining:
+            raise IndexError("draw from an empty deck")
+        self.remaining -= 1
+        return self.names[self.upcoming.pop(0) if self.upcoming else self.sample()]
+
+    def peek(self, count):
+        while len(self.upcoming) < min(count, self.remaining):
+            self.upcoming.append(self.sample())
+        return [self.names[index] for index in self.upcoming[:max(count, 0)]]
+
+def weakest_weight(stat, now):
+    if stat is None:
+        return 0.5
+    return (stat.asked - stat.correct + 1) / (stat.asked + 2)  # Smoothed share of wrong answers
+
+def spaced_weight(stat, now):
+    if stat is None or not stat.asked:
+        return 1.0
+    interval = spaced_base_interval * 2 ** min(stat.streak, 20)
+    waited = now - stat.last_asked
+    if waited >= interval:
+        return 1.0 + (waited - interval) / interval  # Overdue: the longer, the likelier
+    return not_due_weight * waited / interval
+
+weight_functions = {"weakest": weakest_weight, "spaced": spaced_weight}
+
+# Build the deck for a new game in the given mode
+def make_deck(mode, names, stats=None, rng=None, now=None):
+    if mode == "uniform" or stats is None:
+        return WeightedDeck(names, [1.0] * len(names), rng)
+    weight = weight_functions[mode]
+    now = time.time() if now is None else now
+    return WeightedDeck(names, [weight(stats.get(name), now) for name in names], rng)
+
+# Time building a deck and drawing from it for a large synthetic catalog
+def benchmark(count, draws, seed=0):
+    rng = random.Random(seed)
+    names = [f"Flag {index}" for index in range(count)]
+    stats = FlagStats(None)
+    now = time.time()
+    for name in rng.sample(names, count // 2):
+        for _ in range(rng.randrange(1, 6)):
+            stats.record(name, rng.random() < 0.7, now - rng.uniform(0, 30 * 86400))
+
+    for mode in modes:
+        start = time.perf_counter()
+        deck = make_deck(mode, names, stats, rng, now)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(min(draws, count)):
+            deck.draw()
+        drawn = time.perf_counter() - start
+        print(f"{mode:<8} build {built * 1000:7.1f} ms   draw {drawn / min(draws, count) * 1e6:6.2f} us/flag")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the weighted question scheduler")
+    parser.add_argument("--flags", type=int, default=100000, help="Size of the synthetic catalog")
+    parser.add_argument("--draws", type=int, default=10000, help="Flags drawn per mode")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    benchmark(args.flags, args.draws)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import csv
+
+# How the player has done on every flag, kept across games in csv/flag_stats.csv so the
+# scheduler can bring back the flags they get wrong. Updated in memory after every question and
+# written out (to a temporary file renamed over the old one) when the game ends or closes.
+
+stats_path = "csv/flag_stats.csv"
+
+class FlagStat:
+    __slots__ = ("asked", "correct", "streak", "last_asked")
+
+    def __init__(self, asked=0, correct=0, streak=0, last_asked=0.0):
+        self.asked = asked
+        self.correct = correct
+        self.streak = streak  # Correct answers in a row, reset by a wrong one
+        self.last_asked = last_asked  # Unix time
+
+class FlagStats:
+    def __init__(self, path=stats_path):
+        self.path = path
+        self.stats = {}  # Flag name -> FlagStat
+        self.changed = False
+        if path and os.path.exists(path):
+            with open(path, mode='r', encoding='utf-8') as file:
+                reader = csv.reader(file)
+                next(reader, None)  # Skip header row
+                skipped = []  # Line numbers of rows that couldn't be read
+                for row in reader:
+                    if not row:  # Blank line
+                        continue
+                    try:
+                        if len(row) != 5:
+                            raise ValueError
+                        self.stats[row[0]] = FlagStat(int(row[1]), int(row[2]), int(row[3]), float(row[4]))
+                    except ValueError:
+                        skipped.append(reader.line_num)
+                if skipped:
+                    print(f"Skipped {len(skipped)} unreadable rows in {path} (lines {', '.join(map(str, skipped[:10]))}"
+                          f"{', ...' if len(skipped) > 10 else ''}).")
+
+    def __len__(self):
+        return len(self.stats)
+
+    def get(self, flag_name):
+        return self.stats.get(flag_name)
+
+    def record(self, flag_name, correct, when):
+        stat = self.stats.get(flag_name)
+        if stat is None:
+            stat = self.stats[flag_name] = FlagStat()
+        stat.asked += 1
+        stat.correct += int(correct)
+        stat.streak = stat.streak + 1 if correct else 0
+        stat.last_asked = when
+        self.changed = True
+
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, mode='w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(["Name", "Asked", "Correct", "Streak", "LastAsked"])
+            for flag_name, stat in self.stats.items():
+                writer.writerow([flag_name, stat.asked, stat.correct, stat.streak, f"{stat.last_asked:.0f}"])
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+        self.changed = False
@@ -0,0 +1,220 @@
+import time
+import random
+import argparse
+from answer_index import AnswerIndex, normalize_answer
+
+# Edit distance between two strings, giving up early once every path is over max_distance
+# (returns max_distance + 1 in that case, which is all callers need to know)
+def levenshtein(a, b, max_distance):
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            cost = previous[j - 1] + (char_a != char_b)
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current.append(cost)
+            if cost < row_min:
+                row_min = cost
+        if row_min > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+# Every string made by removing one character from word
+def deletes(word):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+# Deletion neighbourhood index: each answer is stored under itself and every one-character
+# deletion of it. Two words within one edit always share such a variant, so a lookup is a few
+# dict probes instead of a scan of the catalog. Deeper query-side deletions also reach most
+# answers two edits away, which is good enough for "did you mean" suggestions.
+class DeletionIndex:
+    def __init__(self):
+        self.variants = {}  # Word or one-deletion variant -> set of answers
+
+    def add(self, word):
+        for variant in deletes(word) | {word}:
+            self.variants.setdefault(variant, set()).add(word)
+
+    def candidates(self, word, depth):
+        seen = {word}
+        frontier = {word}
+        for _ in range(depth):
+            frontier = {variant for current in frontier for variant in deletes(current)} - seen
+            seen |= frontier
+        found = set()
+        for variant in seen:
+            found |= self.variants.get(variant, set())
+        return found
+
+    # (distance, answer) pairs within max_distance of word, closest first
+    def search(self, word, max_distance):
+        if max_distance <= 0:
+            return [(0, word)] if word in self.variants.get(word, ()) else []
+        results = []
+        for candidate in self.candidates(word, max_distance):
+            distance = levenshtein(word, candidate, max_distance)
+            if distance <= max_distance:
+                results.append((distance, candidate))
+        results.sort()
+        return results
+
+# Typo tolerant matching on top of an AnswerIndex. Short guesses get less slack than long ones.
+# While the player is still typing (partial=True) a guess is only taken as a misspelling when it
+# can't be the start of another flag's answer and no other flag's answer is as close, so "Nige"
+# isn't accepted for Niger on the way to "Nigeria", nor "Austra" for Austria.
+
+# Flags whose names start like another flag's, as (flag, what the player types) pairs
+confusable_names = [("Niger", "Nigeria"), ("Austria", "Australia"), ("Dominica", "Dominican Republic"),
+                    ("Guinea", "Guinea-Bissau"), ("Samoa", "American Samoa"), ("Sudan", "South Sudan")]
+class FuzzyMatcher:
+    def __init__(self, answer_index, max_distance=2, letters_per_edit=4):
+        self.answer_index = answer_index
+        self.max_distance = max_distance
+        self.letters_per_edit = letters_per_edit
+        self.index = DeletionIndex()
+        self.flag_answers = {}  # Flag name -> normalized answers, to measure a guess against one flag
+        for key, flag_names in answer_index.answers.items():
+            self.index.add(key)
+            for flag_name in flag_names:
+                self.flag_answers.setdefault(flag_name, set()).add(key)
+
+    def allowed_distance(self, key):
+        return min(self.max_distance, len(key) // self.letters_per_edit)
+
+    def add(self, flag_name, answer):
+        self.answer_index.add(flag_name, answer)
+        key = normalize_answer(answer)
+        if key:
+            self.index.add(key)
+            self.flag_answers.setdefault(flag_name, set()).add(key)
+
+    # Whether an answer for a flag other than flag_name starts with key
+    def prefix_of_other(self, flag_name, key):
+        answers = self.answer_index.answers
+        return any(answers[other] - {flag_name} for other in self.answer_index.trie.keys_with_prefix(key))
+
+    # Accept a guess that is close to one of this flag's answers, unless another answer is closer
+    # (or, with partial, as close or still being typed)
+    def matches(self, flag_name, guess, partial=False):
+        if self.answer_index.matches(flag_name, guess):
+            return True
+        key = normalize_answer(guess)
+        allowed = self.allowed_distance(key)
+        if not allowed:
+            return False
+
+        # Most keystrokes stop here after comparing against the handful of answers for this flag
+        distance = min((levenshtein(key, answer, allowed) for answer in self.flag_answers.get(flag_name, ())),
+                       default=allowed + 1)
+        if distance > allowed:
+            return False
+
+        if partial:
+            if self.prefix_of_other(flag_name, key):
+                return False
+            answers = self.answer_index.answers
+            return not any(answers[answer] - {flag_name} for _, answer in self.index.search(key, distance))
+
+        # Only answers for other flags can be closer, since distance is the best this flag has
+        return not self.index.search(key, distance - 1)
+
+    # Known answers closest to a guess, as (distance, spelling) pairs, for the register dialog
+    def closest(self, guess, limit=3, max_distance=None):
+        key = normalize_answer(guess)
+        if not key:
+            return []
+        max_distance = self.max_distance if max_distance is None else max_distance
+        results = self.index.search(key, max_distance)[:limit]
+        return [(distance, self.answer_index.spellings[answer]) for distance, answer in results]
+
+# Pronounceable made-up place names, so the benchmark catalog has realistic shared prefixes
+def synthetic_names(count, seed=0):
+    rng = random.Random(seed)
+    syllables = ["ba", "ran", "to", "vel", "mi", "sa", "nor", "ka", "lin", "de", "por", "u", "sto", "an", "ber",
+                 "gal", "che", "ri", "mon", "ta", "san", "fe", "ha", "ven", "os", "li", "cas", "tel", "wick", "burg"]
+    names = set()
+    while len(names) < count:
+        words = ["".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 2))]
+        names.add(" ".join(words).title())
+    return sorted(names)
+
+# Introduce one random typo (swap, drop, double or replace a letter)
+def misspell(name, rng):
+    position = rng.randrange(len(name))
+    edit = rng.choice(["swap", "drop", "double", "replace"])
+    if edit == "swap" and position < len(name) - 1:
+        return name[:position] + name[position + 1] + name[position] + name[position + 2:]
+    if edit == "drop":
+        return name[:position] + name[position + 1:]
+    if edit == "double":
+        return name[:position] + name[position] + name[position:]
+    return name[:position] + rng.choice("abcdefghijklmnopqrstuvwxyz") + name[position + 1:]
+
+# Type each confusable name keystroke by keystroke on the other flag, as auto_submit_if_correct
+# does; returns the (flag, text) pairs taken as a typo of the flag's answer along the way (typing
+# "Nigeria" passes through "Niger" itself, which is rightly accepted)
+def confusable_accepts(matcher, pairs=confusable_names):
+    accepted = []
+    for flag_name, typed in pairs:
+        for length in range(1, len(typed) + 1):
+            text = typed[:length]
+            if matcher.answer_index.matches(flag_name, text):
+                break
+            if matcher.matches(flag_name, text, partial=True):
+                accepted.append((flag_name, text))
+                break
+    return accepted
+
+def benchmark(count, queries, max_distance):
+    names = synthetic_names(count) + [name for pair in confusable_names for name in pair]
+    answer_index = AnswerIndex({name: [] for name in names})
+    start = time.perf_counter()
+    matcher = FuzzyMatcher(answer_index, max_distance)
+    build_time = time.perf_counter() - start
+
+    rng = random.Random(1)
+    targets = [rng.choice(names) for _ in range(queries)]
+    guesses = [misspell(name, rng) for name in targets]
+
+    # Every prefix of a guess is what auto_submit_if_correct sees while the player types it
+    keystrokes = [(target, guess[:length]) for target, guess in zip(targets, guesses) for length in range(1, len(guess) + 1)]
+    latencies = []
+    for target, text in keystrokes:
+        start = time.perf_counter()
+        matcher.matches(target, text, partial=True)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    start = time.perf_counter()
+    accepted = sum(matcher.matches(target, guess) for target, guess in zip(targets, guesses))
+    suggestions = [matcher.closest(guess) for guess in guesses]
+    closest_time = (time.perf_counter() - start) / queries
+    print(f"{count} answers, index built in {build_time:.2f}s, max distance {max_distance}")
+    print(f"{len(keystrokes)} keystrokes: mean {sum(latencies) / len(latencies) * 1000:.3f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.3f} ms, max {latencies[-1] * 1000:.3f} ms")
+    print(f"{accepted}/{queries} misspelt full answers accepted, "
+          f"{sum(bool(found) for found in suggestions)}/{queries} had closest answers "
+          f"(match + closest lookup {closest_time * 1000:.3f} ms each)")
+    wrong = confusable_accepts(matcher)
+    print(f"{len(wrong)}/{len(confusable_names)} other countries' names accepted while typing"
+          + "".join(f"\n  {flag_name}: '{text}'" for flag_name, text in wrong))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark typo tolerant answer matching")
+    parser.add_argument("--answers", type=int, default=30000, help="Number of synthetic answers to index")
+    parser.add_argument("--queries", type=int, default=200, help="Number of misspelt guesses to type")
+    parser.add_argument("--max-distance", type=int, default=2, help="Largest edit distance accepted")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    benchmark(args.answers, args.queries, args.max_distance)
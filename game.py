@@ -1,60 +1,177 @@
+import time
+startup_time = time.perf_counter()  # Before the imports below, so --profile-startup can time them
+
 import os
-import random
+import argparse
+import threading
 import tkinter as tk
-from PIL import Image, ImageTk
-from tkinter import messagebox
-import csv
-import pygame  # Import pygame for sound effects
-import webbrowser  # Import webbrowser to open Wikipedia links
-import time  # Import time to track elapsed time
+from flag_bundle import FlagBundle, load_flag_image, display_size, variant_box_for  # Packed flag images at several sizes, built by get_images.py
+from image_cache import FlagImageCache  # Decodes upcoming flags in the background
+from answer_registry import AnswerRegistry  # Saves registered answers in the background
+from game_engine import FlagGameEngine, load_game_data  # Scoring, questions and guess checking
+from flag_scheduler import make_deck, modes  # Question order, weighted by how the player has done before
+from flag_stats import FlagStats, stats_path  # The player's results per flag, kept between games
+from telemetry import Telemetry  # Opt-in latency histograms for the hot paths below
+# pygame (sound effects), PIL.ImageTk and webbrowser are imported where they are first needed,
+# so the window doesn't wait for them
+
+valid_answers_path = "csv/valid_answers.csv"
+catalog_cache_path = "cache/catalog.pickle"  # Catalog built from the CSV and flag images, reused until they change
+sound_paths = {"correct": "res/correct_answer.wav", "wrong": "res/wrong_answer.wav"}
+startup_budget = 0.5  # Seconds from launch to the first flag on screen that --profile-startup checks against
+telemetry_report_path = "telemetry.json"  # Written on exit with --telemetry; a .prom path gives Prometheus text
+overlay_interval = 500  # Milliseconds between refreshes of the --telemetry overlay
+flag_margin = (100, 375)  # Window space taken by everything but the flag; at 525x525 that leaves 300x150
+
+# Records how long each step of starting the game takes, for --profile-startup
+class StartupProfile:
+    def __init__(self, enabled=False, start=startup_time):
+        self.enabled = enabled
+        self.start = start
+        self.last = start
+        self.steps = []  # (step, seconds it took, seconds since launch)
+        self.reported = False
+
+    def mark(self, step):
+        if self.enabled:
+            now = time.perf_counter()
+            self.steps.append((step, now - self.last, now - self.start))
+            self.last = now
+
+    # Steps that finish on another thread are timed from launch, not from the previous step.
+    # Ones finishing after the report has been printed are printed on their own.
+    def mark_background(self, step):
+        if self.enabled:
+            elapsed = time.perf_counter() - self.start
+            self.steps.append((step, elapsed, elapsed))
+            if self.reported:
+                print(f"  {step:<28} {elapsed * 1000:8.1f} ms after launch")
+
+    def report(self, first_flag_step):
+        self.reported = True
+        print("Startup profile:")
+        for step, seconds, since_launch in self.steps:
+            print(f"  {step:<28} {seconds * 1000:8.1f} ms   (at {since_launch * 1000:8.1f} ms)")
+        first_flag = next((since_launch for step, _, since_launch in self.steps if step == first_flag_step), None)
+        if first_flag is not None:
+            verdict = "within" if first_flag <= startup_budget else "over"
+            print(f"  Time to first flag: {first_flag * 1000:.1f} ms ({verdict} the {startup_budget * 1000:.0f} ms budget)")
+
+# Starts pygame and loads the sound effects on a background thread, so the window doesn't wait
+# for the audio device. Sounds played before they are loaded (or without audio) are skipped.
+class SoundEffects:
+    def __init__(self, paths, profile=None):
+        self.sounds = {}
+        self.profile = profile
+        self.thread = threading.Thread(target=self.load, args=(paths,), name="audio-init", daemon=True)
+        self.thread.start()
+
+    def load(self, paths):
+        try:
+            import pygame  # Import pygame for sound effects
+            pygame.mixer.init()
+            self.sounds = {name: pygame.mixer.Sound(path) for name, path in paths.items()}
+        except Exception as e:
+            print(f"Sound effects are disabled: {e}")
+        if self.profile:
+            self.profile.mark_background("audio ready (background)")
+
+    def play(self, name):
+        sound = self.sounds.get(name)
+        if sound:
+            sound.play()
+
+# Fall back to reading individual PNGs from the flags folder when no bundle has been built
+def open_bundle(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        return FlagBundle(path)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring flag bundle {path}: {e}")
+        return None
 
 class FlagGuessingGame:
-    def __init__(self, master):
+    def __init__(self, master, data=None, bundle=None, profile=None, mode="uniform", telemetry=None):
         self.bg_colour = "#222222"
+        self.profile = profile or StartupProfile()
+        # Time the hot paths before any of them are handed to Tk or the worker threads as callbacks.
+        # With telemetry off (the default) nothing is wrapped.
+        self.telemetry = telemetry or Telemetry()
+        self.telemetry.instrument(self, {"load_flag_image": "image decode", "show_flag_image": "show flag",
+                                         "auto_submit_if_correct": "keystroke", "check_guess": "submit guess",
+                                         "wrong_message_box": "result dialog", "show_register_dialog": "register dialog",
+                                         "game_finished_message_box": "game over dialog"})
+
+        # Start the audio device first, it loads while everything else is set up
+        self.sounds = SoundEffects(sound_paths, self.profile)
+        self.telemetry.instrument(self.sounds, {"play": "play sound"})
         
         self.master = master
         self.master.title("Flag Guesser")
         self.master.geometry("525x525")
         self.master.configure(bg=self.bg_colour)  # Dark background color
-        
-        self.game_ended = False
 
         # Create a frame for the main game area
         self.game_frame = tk.Frame(master, bg=self.bg_colour, bd=10, relief=tk.FLAT)
         self.game_frame.pack(pady=20, padx=20, fill=tk.BOTH, expand=True)
 
-        self.valid_answers_path = "csv/valid_answers.csv"
-        self.flags = self.load_flags("flags", self.valid_answers_path)
-        self.initial_flags = self.load_flags("flags", self.valid_answers_path)
-        self.score = 0
-        self.total_flags = len(self.flags)
-        self.current_question = 0  # Initialize the current question counter
-
-        # Initialize pygame mixer for sound effects
-        pygame.mixer.init()
-        
-        # Load sound effects
-        self.correct_sound = pygame.mixer.Sound("res/correct_answer.wav")
-        self.wrong_sound = pygame.mixer.Sound("res/wrong_answer.wav")
-
-        self.flag_label = tk.Label(self.game_frame, bg=self.bg_colour)
-        self.flag_label.pack(pady=10)
+        # All game rules live in the engine; this class only draws it and plays sounds
+        self.bundle = bundle if bundle is not None else open_bundle("flags.bundle")
+        self.profile.mark("open flag bundle")
+        # The catalog comes from the cache when nothing changed, and the answer index is built in
+        # the background since it's only needed once the player starts typing
+        self.data = data or load_game_data("flags", valid_answers_path, self.bundle, AnswerRegistry(valid_answers_path),
+                                           catalog_cache_path, background=True)
+        if self.data.registry:
+            self.telemetry.instrument(self.data.registry, {"append_to_journal": "save answer", "compact": "compact answers"})
+        self.stats = FlagStats(stats_path)
+        self.telemetry.instrument(self.stats, {"save": "save stats"})
+        deck = make_deck(mode, self.data.catalog.playable_names(), self.stats)
+        self.engine = FlagGameEngine(self.data, deck=deck, stats=self.stats)
+        self.profile.mark("load catalog")
+        if self.profile.enabled:
+            threading.Thread(target=self.wait_for_answer_index, daemon=True).start()
+
+        # Upcoming flags are decoded ahead of time while the player is typing. Images are cached
+        # by (flag, size box), the box being the largest rendered size that fits in the window.
+        self.prefetch_count = 3
+        self.image_cache = FlagImageCache(self.load_flag_image, capacity=32)
+        self.flag_box = display_size
+        self.flag_name = None
+
+        # The flag sits in a frame fixed to the box (in pixels; a Label's own width and height are
+        # characters and lines until it has an image), so flags of different shapes don't move the
+        # widgets below them
+        self.flag_frame = tk.Frame(self.game_frame, bg=self.bg_colour, width=self.flag_box[0], height=self.flag_box[1])
+        self.flag_frame.pack_propagate(False)
+        self.flag_frame.pack(pady=10)
+        self.flag_label = tk.Label(self.flag_frame, bg=self.bg_colour, bd=0, padx=0, pady=0, highlightthickness=0)
+        self.flag_label.pack(expand=True)
+        self.master.bind('<Configure>', self.on_resize)
 
         self.entry = tk.Entry(self.game_frame, font=("Arial", 14), justify='center', bg="#4A4A4A", fg="white", insertbackground='white')
         self.entry.pack(pady=10, padx=10, fill=tk.X)
         
         # Add key release event binding to check for valid answer
         self.entry.bind('<KeyRelease>', self.auto_submit_if_correct)
+        # Tab fills in the first autocomplete suggestion
+        self.entry.bind('<Tab>', self.accept_suggestion)
+
+        # Autocomplete suggestions from every known answer, so they don't give the current flag away
+        self.suggestions = []
+        self.suggestion_label = tk.Label(self.game_frame, text="", font=("Arial", 10), bg=self.bg_colour, fg="#AAAAAA")
+        self.suggestion_label.pack()
 
         self.submit_button = tk.Button(self.game_frame, text="Submit Guess", command=self.check_guess,
                                         font=("Arial", 12), bg="#6B8E23", fg="white", padx=10, pady=5)
         self.submit_button.pack(pady=10)
 
-        self.score_label = tk.Label(self.game_frame, text=f"Score: {self.score}/{self.total_flags}",
+        self.score_label = tk.Label(self.game_frame, text=f"Score: {self.engine.score}/{self.engine.total_flags}",
                                      font=("Arial", 12), bg=self.bg_colour, fg="white")
         self.score_label.pack(pady=10)
 
-        self.question_label = tk.Label(self.game_frame, text=f"Question: {self.current_question}/{self.total_flags}",
+        self.question_label = tk.Label(self.game_frame, text=f"Question: {self.engine.current_question}/{self.engine.total_flags}",
                                         font=("Arial", 12), bg=self.bg_colour, fg="white")
         self.question_label.pack(pady=10)
 
@@ -62,10 +179,11 @@ class FlagGuessingGame:
         self.timer_label = tk.Label(self.game_frame, text="Time: 0s", font=("Arial", 12), bg=self.bg_colour, fg="white")
         self.timer_label.pack(pady=10)
 
-        self.start_time = time.time()  # Store the start time
         self.update_timer()  # Start updating the timer
+        self.profile.mark("build window")
 
         self.next_flag()
+        self.profile.mark("decode first flag")
         
         self.entry.focus_set()
 
@@ -78,81 +196,84 @@ class FlagGuessingGame:
                                       font=("Arial", 10), bg="red", fg="white", padx=10, pady=5)
         self.mute_button.pack(side=tk.BOTTOM, anchor=tk.SE, padx=10, pady=10)  # Place in the bottom right of the frame
 
+        # Debug overlay with the latency of each timed operation, F3 hides and shows it
+        if self.telemetry.enabled:
+            self.overlay_label = tk.Label(self.master, text="", font=("Courier", 8), justify=tk.LEFT,
+                                          bg="#000000", fg="#00FF00", anchor=tk.NW)
+            self.overlay_label.place(x=0, y=0)
+            self.master.bind('<F3>', self.toggle_overlay)
+            self.update_overlay()
+
+    def wait_for_answer_index(self):
+        self.data.indexed.wait()
+        self.profile.mark_background("answer index ready (background)")
+
+    def update_overlay(self):
+        self.overlay_label.config(text=self.telemetry.overlay_text() or "telemetry: waiting for events")
+        self.master.after(overlay_interval, self.update_overlay)
+
+    def toggle_overlay(self, event):
+        if self.overlay_label.winfo_ismapped():
+            self.overlay_label.place_forget()
+        else:
+            self.overlay_label.place(x=0, y=0)
+
     def update_timer(self):
-        if not self.game_ended:
-            elapsed_time = int(time.time() - self.start_time)  # Calculate elapsed time in seconds
-            minutes, seconds = divmod(elapsed_time, 60)  # Convert seconds to minutes and seconds
-            self.time_formatted = f"{minutes:02}:{seconds:02}"  # Format the time as MM:SS
+        if not self.engine.game_ended:
+            self.time_formatted = self.engine.elapsed_formatted()  # Elapsed time as MM:SS
             self.timer_label.config(text=f"Time Elapsed: {self.time_formatted}")  # Update the timer label
             
             self.master.after(1000, self.update_timer)  # Call this function again after 1 second
 
-    def load_flags(self, folder, answers_file):
-        flags = {}
-        
-        # Check if the valid_answers.csv file exists; if not, create it
-        if not os.path.exists(answers_file):
-            with open(answers_file, mode='w', encoding='utf-8', newline='') as file:
-                writer = csv.writer(file)
-
-        # Load valid answers from the CSV file
-        with open(answers_file, mode='r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                flag_name = row[0].strip()  # Get the flag name
-                valid_answers = [answer.strip() for answer in row[1:]] if len(row) > 1 else []
-                # Remove duplicates by converting to a set and back to a list
-                unique_answers = list(set(valid_answers))
-                # Add the flag name itself as a valid answer
-                flags[flag_name] = unique_answers  # Include the flag name
-
-        # Load flags from the folder
-        for filename in os.listdir(folder):
-            if filename.endswith(('.png', '.jpg', '.jpeg')):
-                flag_name = os.path.splitext(filename)[0]
-                if flag_name not in flags:
-                    flags[flag_name] = [flag_name]  # Initialize with the flag name if not found
-
-        return flags
-
-    def save_valid_answers(self):
-        with open(self.valid_answers_path, mode='w', encoding='utf-8', newline='') as file:
-            writer = csv.writer(file)
-            for flag_name, answers in self.initial_flags.items():
-                writer.writerow([flag_name] + answers)
-
     def next_flag(self):
-        if not self.flags:
+        self.flag_name = self.engine.next_flag()
+        if self.flag_name is None:
             self.end_game()
             return
 
-        self.flag_name, valid_answers = random.choice(list(self.flags.items()))
-        self.show_flag_image(os.path.join("flags", f"{self.flag_name}.png"))
+        # Decoded on the cache's worker thread
+        self.image_cache.prefetch([(flag_name, self.flag_box) for flag_name in self.engine.upcoming_flags(self.prefetch_count)])
+        self.show_flag_image(self.flag_name)
 
         # Update the question counter
-        self.current_question += 1
-        self.question_label.config(text=f"Question: {self.current_question}/{self.total_flags}")  # Update question label
+        self.question_label.config(text=f"Question: {self.engine.current_question}/{self.engine.total_flags}")  # Update question label
 
         # Clear the text box for the next flag
         self.entry.delete(0, tk.END)
+        self.update_suggestions("")
 
-    def show_flag_image(self, flag_path):
-        img = Image.open(flag_path)
-        img = img.resize((300, 150))  # Resize for display
+    def load_flag_image(self, key):
+        flag_name, box = key
+        return load_flag_image(flag_name, self.bundle, box=box)
+
+    def show_flag_image(self, flag_name):
+        from PIL import ImageTk
+        img = self.image_cache.get((flag_name, self.flag_box))  # Only the PhotoImage creation is left for the Tk thread
         self.flag_image = ImageTk.PhotoImage(img)
         self.flag_label.config(image=self.flag_image)
         self.flag_label.image = self.flag_image
 
+    # Switch to another rendered size when the window grows or shrinks past one
+    def on_resize(self, event):
+        if event.widget is not self.master:
+            return  # The binding also fires for every widget inside the window
+        box = variant_box_for((event.width - flag_margin[0], event.height - flag_margin[1]))
+        if box == self.flag_box:
+            return
+        self.flag_box = box
+        self.flag_frame.config(width=box[0], height=box[1])
+        if self.flag_name is not None and not self.engine.game_ended:
+            self.show_flag_image(self.flag_name)
+            self.image_cache.prefetch([(flag_name, box) for flag_name in self.engine.upcoming_flags(self.prefetch_count)])
+
     def check_guess(self):
         guess = self.entry.get().strip()  # Get user input
-        valid_answers = self.flags[self.flag_name] + [self.flag_name]  # Get valid answers for the current flag
 
-        # Check if the guess matches any valid answers in a case-insensitive manner
-        if (guess.lower() in [answer.lower() for answer in valid_answers]) and guess != "":
-            self.score += 1
-            self.score_label.config(text=f"Score: {self.score}/{self.total_flags}")
+        # Check if the guess matches any valid answers, ignoring case, accents and punctuation
+        if self.engine.check_guess(guess):
+            self.score_label.config(text=f"Score: {self.engine.score}/{self.engine.total_flags}")
             if not self.is_muted:  # Check mute state
-                self.correct_sound.play()  # Play correct answer sound
+                self.sounds.play("correct")  # Play correct answer sound
             self.next_flag()
         else:
             # Only show the register dialog if the user has written something
@@ -161,16 +282,29 @@ class FlagGuessingGame:
             else:
                 self.wrong_message_box("Result", f"Wrong! The correct answer was: {self.flag_name}")
                 if not self.is_muted:  # Check mute state
-                    self.wrong_sound.play() 
+                    self.sounds.play("wrong")
 
     def auto_submit_if_correct(self, event):
         guess = self.entry.get().strip()
-        valid_answers = self.flags[self.flag_name] + [self.flag_name]
 
-        if guess.lower() in [answer.lower() for answer in valid_answers]:
+        if self.engine.is_correct(guess, partial=True):
             self.submit_button.invoke()
+        else:
+            self.update_suggestions(self.entry.get())
+
+    def update_suggestions(self, text):
+        self.suggestions = self.engine.suggest(text)
+        self.suggestion_label.config(text="   ".join(self.suggestions))
+
+    def accept_suggestion(self, event):
+        if self.suggestions:
+            self.entry.delete(0, tk.END)
+            self.entry.insert(0, self.suggestions[0])
+            self.auto_submit_if_correct(event)
+        return "break"  # Keep focus in the entry box
 
     def open_wikipedia_link(self, event):
+        import webbrowser
         webbrowser.open(self.wiki_link)  # Open the Wikipedia link in the browser
         
     def on_link_hover(self, event):
@@ -258,8 +392,12 @@ class FlagGuessingGame:
         self.register_dialog.title("Register Alternative Answer")
         self.register_dialog.configure(bg=self.bg_colour)
 
+        # Known answers close to the guess, in case it was a misspelling of another flag
+        closest = self.engine.closest_answers(guess)
+        closest_text = f"\n\nClosest known answers: {', '.join(closest)}" if closest else ""
+
         # Set the size of the dialog
-        self.register_dialog.geometry("300x175")
+        self.register_dialog.geometry("300x225" if closest else "300x175")
 
         # Center the dialog relative to the main window
         x = self.master.winfo_x() + (self.master.winfo_width() // 2) - 150
@@ -267,7 +405,7 @@ class FlagGuessingGame:
         self.register_dialog.geometry(f"+{x}+{y}")
 
         msg_label = tk.Label(self.register_dialog, 
-                             text=f"Would you like to register '{guess}' for {self.flag_name} as an alternative answer for this flag?", 
+                             text=f"Would you like to register '{guess}' for {self.flag_name} as an alternative answer for this flag?{closest_text}", 
                              bg=self.bg_colour, 
                              fg="white", 
                              font=("Arial", 12), 
@@ -302,35 +440,34 @@ class FlagGuessingGame:
         self.msg_box.destroy()
         
         self.entry.delete(0, tk.END)  # Clear entry field
-        del self.flags[self.flag_name]  # Remove the flag from the game
         
         self.next_flag() 
 
     def stop_register(self):
         self.register_dialog.destroy()
         self.wrong_message_box("Result", f"Wrong! The correct answer was: {self.flag_name}")
-        self.wrong_sound.play()
+        self.sounds.play("wrong")
 
     def register_answer(self, guess):
-        self.register_alternative(guess)  # Register the alternative answer
-        self.correct_sound.play()  # Play correct answer sound
+        self.engine.register_answer(guess)  # Register the alternative answer and award the point
+        self.sounds.play("correct")  # Play correct answer sound
         self.register_dialog.destroy()
         self.wrong_message_box("Answer Registered", "A new answer has been registered! You receive 1 point.")
-        self.score += 1  # Increment score for registering an answer
-        self.score_label.config(text=f"Score: {self.score}/{self.total_flags}")  # Update score display
-
-    def register_alternative(self, guess):
-        if self.flag_name in self.initial_flags:
-            self.initial_flags[self.flag_name].append(guess)  # Add to the existing answers
-        else:
-            self.initial_flags[self.flag_name] = [guess]  # Create a new entry
-
-        # Save the updated valid answers to the CSV file
-        self.save_valid_answers()
+        self.score_label.config(text=f"Score: {self.engine.score}/{self.engine.total_flags}")  # Update score display
 
     def end_game(self):
-        self.game_finished_message_box("Game Over", f"Your final score is: {self.score}/{self.total_flags}\n\nTime player for: {self.time_formatted}")
-        self.game_ended = True
+        if self.profile.enabled or self.telemetry.enabled:  # Only when asked for with --profile-startup or --telemetry
+            print(f"Image cache: {self.image_cache.stats()}")
+        self.save_stats()
+        self.time_formatted = self.engine.elapsed_formatted()
+        self.game_finished_message_box("Game Over", f"Your final score is: {self.engine.score}/{self.engine.total_flags}\n\nTime player for: {self.time_formatted}")
+
+    def save_stats(self):
+        self.engine.record_result()  # Counts a flag left unanswered when the window is closed
+        try:
+            self.stats.save()
+        except OSError as e:
+            print(f"Failed to save flag stats: {e}")
 
     def toggle_mute(self):
         self.is_muted = not self.is_muted  # Toggle mute state
@@ -340,7 +477,48 @@ class FlagGuessingGame:
         else:
             self.mute_button.config(text="Mute")
 
-# Create the main application window
-root = tk.Tk()
-game = FlagGuessingGame(root)
-root.mainloop()
+def report_startup(profile):
+    profile.mark("first frame drawn")
+    profile.report("first frame drawn")
+
+def add_arguments(parser):
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print how long each step of starting the game took")
+    parser.add_argument("--mode", choices=modes, default="uniform",
+                        help="Question order: uniform, weakest (flags you get wrong first) or spaced (spaced repetition)")
+    parser.add_argument("--telemetry", action="store_true",
+                        help="Time image decoding, keystrokes, saves, dialogs and sounds, show an overlay (F3) and write a report on exit")
+    parser.add_argument("--telemetry-report", default=telemetry_report_path,
+                        help="Where --telemetry writes its report: JSON, or Prometheus text for a .prom or .txt path")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Guess the flag")
+    add_arguments(parser)
+    return parser.parse_args(argv)
+
+def run(args):
+    profile = StartupProfile(args.profile_startup)
+    profile.mark("imports")
+    # Create the main application window
+    root = tk.Tk()
+    profile.mark("create Tk root")
+    telemetry = Telemetry(args.telemetry)
+    game = FlagGuessingGame(root, profile=profile, mode=args.mode, telemetry=telemetry)
+    if args.profile_startup:
+        root.after_idle(report_startup, profile)  # Once the window has been drawn with the first flag in it
+    root.mainloop()
+    game.save_stats()
+    game.data.close()  # Write out any queued answers and fold them into valid_answers.csv
+    if telemetry.enabled:  # After the final saves, so they are in the report too
+        print(telemetry.overlay_text())
+        try:
+            telemetry.write_report(args.telemetry_report)
+            print(f"Telemetry report written to {args.telemetry_report}")
+        except OSError as e:
+            print(f"Failed to write telemetry report: {e}")
+
+def main():
+    run(parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import time
+import threading
+from answer_index import AnswerIndex
+from fuzzy_match import FuzzyMatcher
+from flag_catalog import FlagDeck, load_flags
+
+# Everything about a game that doesn't need a window: question order, guess checking, scoring,
+# answer registration and timing. game.py is a Tk front end for this, and the same engine runs
+# headless in simulate.py.
+
+# Flag data shared by every game in the process: the catalog, the answer matcher and where
+# registered answers are saved. Loading it is the expensive part, so do it once. With
+# background=True the answer index is built on a thread, so the first question can be shown
+# straight away; anything that needs the index waits until it's ready.
+class GameData:
+    def __init__(self, catalog, registry=None, max_distance=2, background=False):
+        self.catalog = catalog
+        self.answers = catalog.overlay()  # Answers registered since the catalog was loaded
+        self.max_distance = max_distance  # Allowed typos per guess (long answers)
+        self.registry = registry  # Optional AnswerRegistry that saves registrations to disk
+        self.indexed = threading.Event()
+        if background:
+            threading.Thread(target=self.build_index, name="answer-index", daemon=True).start()
+        else:
+            self.build_index()
+
+    def build_index(self):
+        self.index = AnswerIndex(self.catalog)
+        self.fuzzy_matcher = FuzzyMatcher(self.index, self.max_distance)
+        self.indexed.set()
+
+    @property
+    def answer_index(self):
+        self.indexed.wait()
+        return self.index
+
+    @property
+    def matcher(self):
+        self.indexed.wait()
+        return self.fuzzy_matcher
+
+    def register(self, flag_name, answer):
+        self.answers.register(flag_name, answer)  # Add to the existing answers
+        self.matcher.add(flag_name, answer)  # Accept it for the rest of this game too
+        if self.registry:
+            self.registry.register(flag_name, answer)  # Written to disk by the registry's background thread
+
+    def close(self):
+        if self.registry:
+            self.registry.close()
+
+def load_game_data(folder, answers_file, bundle=None, registry=None, catalog_cache=None, background=False):
+    return GameData(load_flags(folder, answers_file, bundle, catalog_cache), registry, background=background)
+
+# One player's game: asks every playable flag once in shuffled order. A deck (such as a
+# CompactDeck over a shared name list, or a WeightedDeck from flag_scheduler) can be passed in
+# instead of building a FlagDeck. With stats, how each question went is recorded in them.
+class FlagGameEngine:
+    def __init__(self, data, rng=None, clock=time.time, deck=None, stats=None):
+        self.data = data
+        self.deck = deck if deck is not None else FlagDeck(data.catalog.playable_names(), rng)
+        self.stats = stats  # Optional FlagStats
+        self.answered = False  # Whether the current flag was answered correctly (or registered)
+        self.recorded = True  # Whether the current flag's result is already in stats
+        self.clock = clock
+        self.total_flags = len(self.deck)
+        self.score = 0
+        self.current_question = 0
+        self.flag_name = None
+        self.game_ended = False
+        self.start_time = clock()
+        self.end_time = None
+
+    # Move on to the next flag; returns its name, or None once every flag has been asked
+    def next_flag(self):
+        self.record_result()
+        if not self.deck:
+            self.end_game()
+            return None
+        self.flag_name = self.deck.draw()
+        self.current_question += 1
+        self.answered = False
+        self.recorded = False
+        return self.flag_name
+
+    def record_result(self):
+        if self.stats is not None and not self.recorded:
+            self.stats.record(self.flag_name, self.answered, self.clock())
+        self.recorded = True
+
+    # The flags that will come after the current one, for prefetching their images
+    def upcoming_flags(self, count):
+        return self.deck.peek(count)
+
+    # Whether a guess is a valid answer for the current flag, ignoring case, accents and punctuation.
+    # partial is for text still being typed, where a typo is only forgiven if it's unambiguous.
+    def is_correct(self, guess, partial=False):
+        guess = guess.strip()
+        return guess != "" and self.data.matcher.matches(self.flag_name, guess, partial)
+
+    # Check a submitted guess (or, with partial, text still being typed) and score it; returns
+    # whether it was correct
+    def check_guess(self, guess, partial=False):
+        if self.is_correct(guess, partial):
+            self.score += 1
+            self.answered = True
+            return True
+        return False
+
+    # Accept a wrong guess as a new answer for the current flag; registering earns the point
+    def register_answer(self, guess):
+        self.data.register(self.flag_name, guess.strip())
+        self.score += 1
+        self.answered = True
+
+    def suggest(self, text, limit=5):
+        return self.data.answer_index.suggest(text, limit) if text.strip() else []
+
+    def closest_answers(self, guess, limit=3):
+        return [answer for distance, answer in self.data.matcher.closest(guess, limit)]
+
+    def elapsed_seconds(self):
+        return (self.end_time or self.clock()) - self.start_time
+
+    def elapsed_formatted(self):
+        minutes, seconds = divmod(int(self.elapsed_seconds()), 60)  # Convert seconds to minutes and seconds
+        return f"{minutes:02}:{seconds:02}"  # Format the time as MM:SS
+
+    def end_game(self):
+        self.record_result()
+        if not self.game_ended:
+            self.game_ended = True
+            self.end_time = self.clock()
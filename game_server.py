@@ -0,0 +1,405 @@
+import os
+import io
+import json
+import time
+import base64
+import struct
+import asyncio
+import hashlib
+import secrets
+import argparse
+import tempfile
+from urllib.parse import unquote
+from answer_registry import AnswerRegistry
+from flag_catalog import CompactDeck
+from game_engine import FlagGameEngine, GameData, load_game_data
+
+# Runs the quiz for many players at once from one process: the catalog, the answer matcher and
+# the encoded flag images are loaded once and shared, and every player only has a small game
+# session (score, a compact deck and the timer). Players connect over a WebSocket; guesses are
+# checked on the server with the same engine game.py uses, and registered answers go through
+# the AnswerRegistry, which writes them to disk in batches. Only the standard library is used.
+#
+# Messages are JSON objects with a "type":
+#   start {session?}  -> question (resumes the session if its id is given)
+#   typing {text}     -> question if the text is already correct, otherwise suggestions
+#   guess {text}      -> question if correct, otherwise result with the closest known answers
+#   register {text}   -> question (the guess becomes a new answer and earns the point); only
+#                        accepted straight after a wrong guess of the same text for this flag,
+#                        and at most max_registrations per register_window seconds per session
+#   skip              -> question with the previous answer revealed
+#   quit              -> end (the session is dropped straight away instead of kept for resuming)
+# When every flag has been asked the reply is an "end" message with the final score instead.
+
+default_host = "127.0.0.1"
+default_port = 8765
+session_timeout = 1800  # Seconds a disconnected session is kept so the player can resume
+max_message_size = 64 * 1024
+max_registrations = 5  # Answers one session may register per register_window
+register_window = 60.0  # Seconds
+websocket_guid = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+
+# Opcodes of the WebSocket frames used here
+text_opcode = 0x1
+close_opcode = 0x8
+ping_opcode = 0x9
+pong_opcode = 0xA
+
+def websocket_accept(key):
+    return base64.b64encode(hashlib.sha1((key + websocket_guid).encode()).digest()).decode()
+
+# XOR the payload with the 4-byte mask as one big integer instead of byte by byte
+def apply_mask(payload, mask):
+    repeated = (mask * (len(payload) // 4 + 1))[:len(payload)]
+    return (int.from_bytes(payload, "big") ^ int.from_bytes(repeated, "big")).to_bytes(len(payload), "big")
+
+# Client frames must be masked, server frames must not be
+def encode_frame(opcode, payload, masked=False):
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if masked else 0
+    if len(payload) < 126:
+        header.append(mask_bit | len(payload))
+    elif len(payload) < 65536:
+        header.append(mask_bit | 126)
+        header += struct.pack("!H", len(payload))
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack("!Q", len(payload))
+    if masked:
+        mask = os.urandom(4)
+        header += mask
+        payload = apply_mask(payload, mask)
+    return bytes(header) + payload
+
+async def read_frame(reader):
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack("!H", await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack("!Q", await reader.readexactly(8))[0]
+    if length > max_message_size:
+        raise ValueError(f"Frame of {length} bytes is too large")
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    return bool(first & 0x80), first & 0x0F, apply_mask(payload, mask) if mask else payload
+
+# Read one text message (joining continuation frames and answering pings); None once closed
+async def read_message(reader, writer, masked=False):
+    parts = []
+    while True:
+        try:
+            fin, opcode, payload = await read_frame(reader)
+        except asyncio.IncompleteReadError:
+            return None
+        if opcode == close_opcode:
+            writer.write(encode_frame(close_opcode, payload[:2], masked))
+            return None
+        if opcode == ping_opcode:
+            writer.write(encode_frame(pong_opcode, payload, masked))
+            continue
+        if opcode == pong_opcode:
+            continue
+        parts.append(payload)
+        if sum(len(part) for part in parts) > max_message_size:
+            raise ValueError("Message is too large")
+        if fin:
+            return b"".join(parts).decode("utf-8")
+
+def send_message(writer, message, masked=False):
+    writer.write(encode_frame(text_opcode, json.dumps(message).encode("utf-8"), masked))
+
+# Request line and headers of one HTTP request; None if the connection closed first
+async def read_request(reader):
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        return None
+    lines = head.decode("latin-1").split("\r\n")
+    method, path, version = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return method, path, version, headers
+
+def http_response(status, body=b"", content_type="text/plain; charset=utf-8", extra_headers=()):
+    lines = [f"HTTP/1.1 {status}", f"Content-Type: {content_type}", f"Content-Length: {len(body)}"]
+    lines.extend(extra_headers)
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body
+
+# Encoded PNG bytes for a flag: the file in the flags folder as it is, or the bundle's pixels
+# encoded once. PIL is only needed for the bundle, so it's imported here.
+def encoded_flag_loader(folder, bundle=None):
+    def load(flag_name):
+        path = os.path.join(folder, f"{flag_name}.png")
+        if os.path.exists(path):
+            with open(path, "rb") as file:
+                return file.read()
+        from flag_bundle import load_flag_image
+        buffer = io.BytesIO()
+        load_flag_image(flag_name, bundle, folder).save(buffer, format="PNG")
+        return buffer.getvalue()
+    return load
+
+# One player's game and when they were last heard from
+class GameSession:
+    __slots__ = ("session_id", "engine", "last_seen", "connected", "wrong_guess", "registered")
+
+    def __init__(self, session_id, engine):
+        self.session_id = session_id
+        self.engine = engine
+        self.last_seen = time.monotonic()
+        self.connected = True
+        self.wrong_guess = None  # (flag name, text) of the last message if it was a wrong guess
+        self.registered = []  # Times of this session's recent registrations, for the rate limit
+
+class GameServer:
+    def __init__(self, data, images=None):
+        self.data = data
+        self.names = data.catalog.playable_names()  # Shared by every deck; a flag's image number is its position
+        self.numbers = {name: number for number, name in enumerate(self.names)}
+        self.images = images  # FlagImageCache of encoded PNGs, or None to serve no images
+        self.sessions = {}  # Session id -> GameSession
+        self.counters = {"sessions_started": 0, "sessions_finished": 0, "messages": 0, "guesses": 0, "registered": 0,
+                         "registrations_refused": 0}
+
+    def new_session(self):
+        session = GameSession(secrets.token_urlsafe(12), FlagGameEngine(self.data, deck=CompactDeck(self.names)))
+        self.sessions[session.session_id] = session
+        self.counters["sessions_started"] += 1
+        return session
+
+    # Move the session on to its next flag and describe it (or the end of the game)
+    def advance(self, session, reply):
+        if session.engine.next_flag() is None:
+            self.sessions.pop(session.session_id, None)
+            self.counters["sessions_finished"] += 1
+            return self.finished(session, reply)
+        return self.question(session, reply)
+
+    def finished(self, session, reply):
+        engine = session.engine
+        reply.update(type="end", score=engine.score, total=engine.total_flags, time=engine.elapsed_formatted())
+        return reply
+
+    def question(self, session, reply):
+        engine = session.engine
+        reply.update(type="question", session=session.session_id, image=f"/images/{self.numbers[engine.flag_name]}.png",
+                     question=engine.current_question, total=engine.total_flags, score=engine.score)
+        return reply
+
+    # Handle one message from a player and return the reply; runs on the event loop thread, so the
+    # shared answer data is never used from two places at once
+    def handle_message(self, session, message):
+        self.counters["messages"] += 1
+        engine = session.engine
+        kind = message.get("type")
+        text = str(message.get("text", ""))[:200]
+        wrong_guess, session.wrong_guess = session.wrong_guess, None  # Only the very next message may register it
+
+        if engine.game_ended:
+            return self.finished(session, {})
+        if kind == "start":
+            # A new session has no flag yet; a resumed one gets its current flag again
+            return self.question(session, {}) if engine.flag_name else self.advance(session, {})
+        if kind == "typing":
+            # Like the game's auto-submit: a correct answer counts as soon as it has been typed
+            if engine.check_guess(text, partial=True):
+                self.counters["guesses"] += 1
+                return self.advance(session, {"correct": True})
+            return {"type": "suggestions", "items": engine.suggest(text)}
+        if kind == "guess":
+            self.counters["guesses"] += 1
+            if engine.check_guess(text):
+                return self.advance(session, {"correct": True})
+            session.wrong_guess = (engine.flag_name, text)
+            return {"type": "result", "correct": False, "closest": engine.closest_answers(text) if text.strip() else []}
+        if kind == "register":
+            now = time.monotonic()
+            session.registered = [when for when in session.registered if now - when < register_window]
+            if not text.strip() or wrong_guess != (engine.flag_name, text):
+                self.counters["registrations_refused"] += 1
+                return {"type": "error", "message": "Only a guess that was just marked wrong can be registered"}
+            if len(session.registered) >= max_registrations:
+                self.counters["registrations_refused"] += 1
+                session.wrong_guess = wrong_guess  # Still registrable once the limit allows
+                return {"type": "error", "message": "Too many answers registered, try again in a minute"}
+            session.registered.append(now)
+            engine.register_answer(text)  # Queued for the registry's batched writes
+            self.counters["registered"] += 1
+            return self.advance(session, {"registered": True})
+        if kind == "skip":
+            return self.advance(session, {"answer": engine.flag_name})
+        if kind == "quit":
+            engine.end_game()
+            self.sessions.pop(session.session_id, None)
+            self.counters["sessions_finished"] += 1
+            return self.finished(session, {})
+        return {"type": "error", "message": f"Unknown message type {kind!r}"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, version, headers = request
+                if headers.get("upgrade", "").lower() == "websocket":
+                    await self.play(reader, writer, headers)
+                    break
+                writer.write(await self.http(method, path))
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close" or version == "HTTP/1.0":
+                    break
+        except (ConnectionError, ValueError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def http(self, method, path):
+        if method != "GET":
+            return http_response("405 Method Not Allowed", b"Only GET is supported")
+        path = unquote(path.split("?", 1)[0])
+        if path == "/":
+            return http_response("200 OK", client_page.encode("utf-8"), "text/html; charset=utf-8")
+        if path == "/stats":
+            stats = dict(self.counters, active_sessions=len(self.sessions), flags=len(self.names))
+            return http_response("200 OK", json.dumps(stats).encode("utf-8"), "application/json")
+        if path.startswith("/images/") and path.endswith(".png") and self.images:
+            number = path[len("/images/"):-len(".png")]
+            if number.isdigit() and int(number) < len(self.names):
+                loop = asyncio.get_running_loop()
+                try:
+                    png = await loop.run_in_executor(None, self.images.get, self.names[int(number)])
+                except Exception as e:
+                    return http_response("500 Internal Server Error", str(e).encode("utf-8"))
+                return http_response("200 OK", png, "image/png", ("Cache-Control: public, max-age=86400",))
+        return http_response("404 Not Found", b"Not found")
+
+    async def play(self, reader, writer, headers):
+        accept = websocket_accept(headers.get("sec-websocket-key", ""))
+        writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                      f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode("latin-1"))
+        session = None
+        try:
+            while True:
+                text = await read_message(reader, writer)
+                if text is None:
+                    break
+                try:
+                    message = json.loads(text)
+                except ValueError:
+                    message = None
+                if not isinstance(message, dict):
+                    send_message(writer, {"type": "error", "message": "Messages must be JSON objects"})
+                    continue
+                if session is None or (session.engine.game_ended and message.get("type") == "start"):
+                    if message.get("type") != "start":
+                        send_message(writer, {"type": "error", "message": "Send a start message first"})
+                        continue
+                    session = self.sessions.get(message.get("session")) or self.new_session()
+                    session.connected = True
+                session.last_seen = time.monotonic()
+                send_message(writer, self.handle_message(session, message))
+                await writer.drain()
+        finally:
+            if session:
+                session.connected = False
+                session.last_seen = time.monotonic()
+
+    # Drop sessions whose player left and didn't come back within the timeout
+    async def expire_sessions(self, timeout=session_timeout):
+        while True:
+            await asyncio.sleep(min(timeout, 60))
+            cutoff = time.monotonic() - timeout
+            for session_id, session in list(self.sessions.items()):
+                if not session.connected and session.last_seen < cutoff:
+                    del self.sessions[session_id]
+
+async def serve(server, host=default_host, port=default_port):
+    listener = await asyncio.start_server(server.handle_connection, host, port, limit=max_message_size)
+    expiry = asyncio.create_task(server.expire_sessions())
+    print(f"Serving {len(server.names)} flags on http://{host}:{port}/")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        expiry.cancel()
+
+# A bare-bones page for playing in a browser
+client_page = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Flag Guesser</title>
+<style>body{background:#222;color:#fff;font-family:Arial;text-align:center}input{font-size:1.2em;text-align:center}
+#hint{color:#aaa}</style></head>
+<body><h1>Flag Guesser</h1><img id="flag" width="300" height="150"><p id="status"></p>
+<input id="guess" autofocus><p id="hint"></p>
+<button id="submit">Submit Guess</button> <button id="register">Register</button> <button id="skip">Skip</button>
+<script>
+const socket = new WebSocket(`ws://${location.host}/play`);
+const $ = id => document.getElementById(id);
+const send = message => socket.send(JSON.stringify(message));
+socket.onopen = () => send({type: "start", session: sessionStorage.getItem("session")});
+socket.onmessage = event => {
+  const message = JSON.parse(event.data);
+  if (message.type === "question") {
+    sessionStorage.setItem("session", message.session);
+    $("flag").src = message.image;
+    $("status").textContent = (message.answer ? `The answer was ${message.answer}. ` : "") +
+      `Question ${message.question}/${message.total}, score ${message.score}`;
+    $("guess").value = ""; $("hint").textContent = "";
+  } else if (message.type === "suggestions") {
+    $("hint").textContent = message.items.join("   ");
+  } else if (message.type === "result") {
+    $("hint").textContent = "Wrong!" + (message.closest.length ? " Closest known answers: " + message.closest.join(", ") : "");
+  } else if (message.type === "error") {
+    $("hint").textContent = message.message;
+  } else if (message.type === "end") {
+    sessionStorage.removeItem("session");
+    $("status").textContent = `Your final score is ${message.score}/${message.total} in ${message.time}`;
+  }
+};
+$("guess").onkeyup = event => event.key === "Enter" ? send({type: "guess", text: $("guess").value})
+                                                      : send({type: "typing", text: $("guess").value});
+$("submit").onclick = () => send({type: "guess", text: $("guess").value});
+$("register").onclick = () => send({type: "register", text: $("guess").value});
+$("skip").onclick = () => send({type: "skip"});
+</script></body></html>
+"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve the flag quiz to many players over HTTP and WebSocket")
+    parser.add_argument("--host", default=default_host)
+    parser.add_argument("--port", type=int, default=default_port)
+    parser.add_argument("--flags-folder", default="flags", help="Folder with the display PNGs")
+    parser.add_argument("--answers-file", default="csv/valid_answers.csv", help="Valid answers CSV (registered answers are added to it)")
+    parser.add_argument("--image-cache", type=int, default=4096, help="Number of encoded flag images kept in memory")
+    parser.add_argument("--synthetic", type=int, metavar="FLAGS",
+                        help="Serve a synthetic catalog of this many flags instead (no images; for load testing)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic catalog")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.synthetic:
+        from simulate import synthetic_catalog
+        registry = AnswerRegistry(os.path.join(tempfile.mkdtemp(), "valid_answers.csv"))
+        data = GameData(synthetic_catalog(args.synthetic, args.seed), registry)
+        images = None
+    else:
+        from flag_bundle import FlagBundle, bundle_path
+        from image_cache import FlagImageCache
+        bundle = FlagBundle(bundle_path) if os.path.exists(bundle_path) else None
+        data = load_game_data(args.flags_folder, args.answers_file, bundle, AnswerRegistry(args.answers_file))
+        images = FlagImageCache(encoded_flag_loader(args.flags_folder, bundle), args.image_cache)
+
+    try:
+        asyncio.run(serve(GameServer(data, images), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        data.close()  # Write out any queued answers and fold them into valid_answers.csv
+
+if __name__ == "__main__":
+    main()
@@ -1,63 +1,366 @@
 import os
 import csv
+import json
+import time
+import hashlib
+import queue
+import random
+import argparse
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from cairosvg import svg2png
+from requests.adapters import HTTPAdapter
+import rasterize
+import flag_bundle
 
 # Define the path to the CSV file and the folders
 csv_file_path = "csv/all_flags.csv"
-flags_folder = "flags"
+flags_folder = rasterize.flags_folder  # Display-sized PNGs read by the game
+sources_folder = rasterize.sources_folder  # Original downloads (mostly SVG), kept for re-rasterizing
+manifest_name = "flags_manifest.json"  # Stored next to the flags folder
 
-# Create the flags folder if it doesn't exist
-os.makedirs(flags_folder, exist_ok=True)
+# Default download settings (can be overridden from the command line)
+default_workers = 8  # Number of downloads running at the same time
+default_host_rate = 10.0  # Maximum requests per second sent to a single host
+default_retries = 3  # Extra attempts for transient errors
+default_backoff = 0.5  # Base delay in seconds, doubled after every failed attempt
+default_max_age = 24 * 3600  # Seconds a download is trusted before asking the server whether it changed
 
-# Function to delete all contents of a directory
-def clear_directory(directory):
-    for filename in os.listdir(directory):
-        file_path = os.path.join(directory, filename)
+# HTTP status codes worth retrying (rate limiting and temporary server errors)
+transient_status_codes = {429, 500, 502, 503, 504}
+
+headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.66 Safari/537.36"
+}
+
+# Records what was downloaded for each flag so reruns only fetch what changed upstream
+class FlagManifest:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # Flag name -> {url, etag, last_modified, sha256, checked_at, source_path, output_path}
+        # Flags with byte-identical images share one source_path
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, mode='r', encoding='utf-8') as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {path}: {e}")
+
+    def get(self, flag_name):
+        with self.lock:
+            return self.entries.get(flag_name)
+
+    def update(self, flag_name, entry):
+        with self.lock:
+            self.entries[flag_name] = entry
+
+    def remove(self, flag_name):
+        with self.lock:
+            self.entries.pop(flag_name, None)
+
+    def save(self):
+        # Write to a temporary file first so an interrupted run never leaves a half-written manifest
+        with self.lock:
+            data = json.dumps(self.entries, indent=1, sort_keys=True, ensure_ascii=False)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, mode='w', encoding='utf-8') as file:
+            file.write(data)
+        os.replace(temp_path, self.path)
+
+def manifest_path_for(folder):
+    return os.path.join(os.path.dirname(os.path.abspath(folder)), manifest_name)
+
+# Delete the given source files unless another flag in the manifest still uses them
+def remove_unreferenced_sources(manifest, paths):
+    with manifest.lock:
+        referenced = {entry.get("source_path") for entry in manifest.entries.values()}
+    for path in set(paths) - referenced:
         try:
-            if os.path.isfile(file_path) or os.path.islink(file_path):
-                os.remove(file_path)  # Remove files and links
-            elif os.path.isdir(file_path):
-                os.rmdir(file_path)  # Remove empty directories
-        except Exception as e:
-            print(f"Failed to delete {file_path}: {e}")
+            remove_file(path)
+        except OSError as e:
+            print(f"Failed to delete {path}: {e}")
 
-# Clear the flags folder
-clear_directory(flags_folder)
+# Delete flags that are no longer listed in all_flags.csv; returns the removed names
+def remove_stale_flags(manifest, wanted_names):
+    removed = []
+    sources = []
+    for flag_name, entry in list(manifest.entries.items()):
+        if flag_name in wanted_names:
+            continue
+        try:
+            if entry.get("output_path"):
+                for path in flag_bundle.variant_paths_for(entry["output_path"]):  # The display PNG and every other size
+                    remove_file(path)
+        except OSError as e:
+            print(f"Failed to delete files for {flag_name}: {e}")
+            continue
+        manifest.remove(flag_name)
+        removed.append(flag_name)
+        if entry.get("source_path"):
+            sources.append(entry["source_path"])
+    remove_unreferenced_sources(manifest, sources)
+    return removed
 
-# Function to download and handle images
-def download_and_convert_image(url, output_path):
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.66 Safari/537.36"
-    }
-    response = requests.get(url, headers=headers)
-    response.raise_for_status()
+# Create one session shared by all workers so connections (and TLS handshakes) are reused
+def create_session(workers=default_workers):
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+# Spaces out requests to the same host so we never exceed the configured rate
+class HostRateLimiter:
+    def __init__(self, requests_per_second):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.next_slot = {}  # Host -> earliest time the next request may be sent
+        self.lock = threading.Lock()
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval  # Reserve the slot before releasing the lock
+        if slot > now:
+            time.sleep(slot - now)
 
-    if url.lower().endswith('.svg'):
+# Fetch a URL, retrying connection errors and transient status codes with exponential backoff
+def fetch_with_retry(session, url, rate_limiter=None, retries=default_retries, backoff=default_backoff, extra_headers=None):
+    for attempt in range(retries + 1):
+        if rate_limiter:
+            rate_limiter.wait(url)
         try:
-            svg2png(bytestring=response.content, write_to=output_path)
-            print(f"SVG converted and saved as PNG to {output_path}")
-        except Exception as e:
-            print(f"Failed to convert SVG to PNG for {url}: {e}")
-    else:
-        with open(output_path, "wb") as image_file:
-            image_file.write(response.content)
-        print(f"Image successfully saved to {output_path}")
+            response = session.get(url, headers=extra_headers, timeout=30)
+            if response.status_code not in transient_status_codes or attempt == retries:
+                response.raise_for_status()
+                return response
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+        # Exponential backoff with a little jitter so workers don't retry in lockstep
+        time.sleep(backoff * (2 ** attempt) * (1 + random.random() * 0.1))
 
-# Read the flag data from the CSV file
-with open(csv_file_path, mode='r', encoding='utf-8') as file:
-    reader = csv.reader(file)
-    next(reader)  # Skip header row
+# Build conditional request headers from a previous manifest entry
+def conditional_headers(entry):
+    request_headers = {}
+    if entry.get("etag"):
+        request_headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        request_headers["If-Modified-Since"] = entry["last_modified"]
+    return request_headers
 
-    for row in reader:
-        flag_name = row[0]
-        image_url = row[1]
+# Sources are stored under the SHA-256 of their bytes, so identical images are kept once. The
+# original file extension is kept so the rasterize stage knows how to decode it.
+def source_path_for(folder, sha256, url):
+    extension = os.path.splitext(urlparse(url).path)[1].lower() or ".png"
+    return os.path.join(folder, f"{sha256}{extension}")
 
-        output_path = os.path.join(flags_folder, f"{flag_name}.png")
+# Function to download the original image; returns the download's part of a manifest entry
+# (url, etag, last_modified, sha256, checked_at, source_path). previous is an earlier entry for
+# the URL: it is returned without any request if it was checked less than max_age seconds ago,
+# and otherwise used to revalidate (returned with a new checked_at if the image hasn't changed).
+# Conversion to the display PNG happens afterwards in the rasterize stage.
+def download_image(url, source_folder=sources_folder, session=None, rate_limiter=None, retries=default_retries,
+                   backoff=default_backoff, previous=None, max_age=0):
+    if session is None:
+        session = create_session(1)
 
+    # Only reuse the previous download when it is for the same URL and its file is still there
+    if previous and (previous.get("url") != url or not os.path.exists(previous.get("source_path", ""))):
+        previous = None
+    if previous and time.time() - previous.get("checked_at", 0) < max_age:
+        return previous
+    extra_headers = conditional_headers(previous) if previous else None
+
+    response = fetch_with_retry(session, url, rate_limiter, retries, backoff, extra_headers)
+    if response.status_code == 304:
+        return dict(previous, checked_at=time.time())
+
+    sha256 = hashlib.sha256(response.content).hexdigest()
+    entry = {
+        "url": url,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": sha256,
+        "checked_at": time.time(),
+        "source_path": source_path_for(source_folder, sha256, url),
+    }
+    if not os.path.exists(entry["source_path"]):
+        # Write next to the final file and rename, so an interrupted run never leaves a truncated
+        # image (the temporary name is per thread, as another URL may have the same bytes)
+        temp_path = f"{entry['source_path']}.{threading.get_ident()}.part"
+        with open(temp_path, "wb") as image_file:
+            image_file.write(response.content)
+        os.replace(temp_path, entry["source_path"])
+        print(f"Image successfully saved to {entry['source_path']}")
+    return entry
+
+# Read (flag name, image url) pairs from the CSV file
+def read_flag_rows(path):
+    with open(path, mode='r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader)  # Skip header row
+        return [(row[0], row[1]) for row in reader if len(row) > 1 and row[1]]
+
+# Download flags as (name, url) rows arrive from any iterable, yielding (flag name, outcome, error)
+# as each one finishes, where outcome is "downloaded", "unchanged" or "failed". Rows are read on
+# their own thread, so downloads start while a slow producer (like the scraper) is still running.
+# Each URL is fetched once however many flags use it, and not at all if it was checked less than
+# max_age seconds ago.
+def download_stream(rows, folder, workers=default_workers, host_rate=default_host_rate,
+                    retries=default_retries, backoff=default_backoff, session=None, manifest=None,
+                    save_every=50, source_folder=sources_folder, max_age=default_max_age):
+    os.makedirs(source_folder, exist_ok=True)
+    session = session or create_session(workers)
+    manifest = manifest or FlagManifest(manifest_path_for(folder))
+    rate_limiter = HostRateLimiter(host_rate)
+    # (flag name, (output path, future)) as downloads finish, then (None, (rows submitted, error))
+    finished = queue.Queue()
+
+    def submit_rows(executor):
+        submitted = 0
+        downloads = {}  # URL -> future of its download
         try:
-            download_and_convert_image(image_url, output_path)
+            for flag_name, image_url in rows:
+                future = downloads.get(image_url)
+                if future is None:
+                    future = executor.submit(download_image, image_url, source_folder, session,
+                                             rate_limiter, retries, backoff, manifest.get(flag_name), max_age)
+                    downloads[image_url] = future
+                output_path = os.path.join(folder, f"{flag_name}.png")
+                future.add_done_callback(lambda future, flag_name=flag_name, output_path=output_path:
+                                         finished.put((flag_name, (output_path, future))))
+                submitted += 1
         except Exception as e:
-            print(f"Failed to download or save {flag_name}: {e}")
+            finished.put((None, (submitted, e)))
+            return
+        finished.put((None, (submitted, None)))
+
+    error = None
+    replaced_sources = []  # Files flags used before this run, deleted at the end if nothing uses them now
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            threading.Thread(target=submit_rows, args=(executor,), name="download-feeder", daemon=True).start()
+            completed = 0
+            submitted = None
+            while submitted is None or completed < submitted:
+                flag_name, item = finished.get()
+                if flag_name is None:
+                    submitted, error = item
+                    continue
+                completed += 1
+                output_path, future = item
+                try:
+                    entry = dict(future.result(), output_path=output_path)
+                    previous = manifest.get(flag_name)
+                    changed = not previous or previous.get("sha256") != entry["sha256"]
+                    if previous and previous.get("source_path") not in (None, entry["source_path"]):
+                        replaced_sources.append(previous["source_path"])
+                    manifest.update(flag_name, entry)
+                    outcome = ("downloaded" if changed else "unchanged", None)
+                except Exception as e:
+                    print(f"Failed to download or save {flag_name}: {e}")
+                    outcome = ("failed", str(e))
+
+                # Checkpoint regularly so an interrupted run can resume where it left off
+                if completed % save_every == 0:
+                    manifest.save()
+                yield (flag_name,) + outcome
+        remove_unreferenced_sources(manifest, replaced_sources)
+    finally:
+        manifest.save()
+    if error:
+        raise error  # Reading the rows failed; everything submitted before that was still recorded
+
+# Sync every flag using a bounded pool of workers; returns a dict of name lists per outcome
+def download_all(rows, folder, workers=default_workers, host_rate=default_host_rate,
+                 retries=default_retries, backoff=default_backoff, session=None, manifest=None,
+                 save_every=50, source_folder=sources_folder, max_age=default_max_age):
+    manifest = manifest or FlagManifest(manifest_path_for(folder))
+    results = {"downloaded": [], "unchanged": [], "failed": [], "removed": []}
+
+    results["removed"] = remove_stale_flags(manifest, {flag_name for flag_name, _ in rows})
+
+    for flag_name, outcome, error in download_stream(rows, folder, workers, host_rate, retries, backoff,
+                                                     session, manifest, save_every, source_folder, max_age):
+        results[outcome].append((flag_name, error) if outcome == "failed" else flag_name)
+    return results
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# Render every flag whose source changed, or that is missing any of its sizes, on a process pool
+def rasterize_changed(manifest, changed_names, workers=None):
+    changed_names = set(changed_names)
+    jobs = []
+    for flag_name, entry in manifest.entries.items():
+        source_path = entry.get("source_path")
+        if not source_path or not os.path.exists(source_path):
+            continue
+        if flag_name in changed_names or rasterize.needs_render(entry["output_path"]):
+            os.makedirs(os.path.dirname(entry["output_path"]) or ".", exist_ok=True)
+            jobs.append((source_path, entry["output_path"]))
+    return rasterize.rasterize_all(jobs, workers)
+
+def print_summary(results, elapsed):
+    print(f"Downloaded {len(results['downloaded'])} flags, {len(results['unchanged'])} unchanged, "
+          f"{len(results['removed'])} removed, {len(results['failed'])} failed, in {elapsed:.1f}s.")
+    for flag_name, error in sorted(results["failed"]):
+        print(f"  {flag_name}: {error}")
+
+def add_arguments(parser):
+    parser.add_argument("--csv", default=csv_file_path, help="CSV file with Name,URL rows")
+    parser.add_argument("--flags-folder", default=flags_folder, help="Folder the display PNG files are written to")
+    parser.add_argument("--sources-folder", default=sources_folder, help="Folder the original downloads are kept in")
+    parser.add_argument("--workers", type=int, default=default_workers, help="Number of parallel downloads")
+    parser.add_argument("--host-rate", type=float, default=default_host_rate,
+                        help="Maximum requests per second per host (0 disables the limit)")
+    parser.add_argument("--retries", type=int, default=default_retries, help="Retries for transient errors")
+    parser.add_argument("--backoff", type=float, default=default_backoff, help="Base retry delay in seconds")
+    parser.add_argument("--raster-workers", type=int, default=None,
+                        help="Number of processes converting images (default: CPU count)")
+    parser.add_argument("--max-age", type=float, default=default_max_age,
+                        help="Seconds before a downloaded flag is checked for changes again (0 checks every flag)")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and download every flag again")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Download flag images listed in all_flags.csv")
+    add_arguments(parser)
+    return parser.parse_args()
+
+def run(args):
+    manifest = FlagManifest(manifest_path_for(args.flags_folder))
+    if args.force:
+        manifest.entries = {}
+
+    rows = read_flag_rows(args.csv)
+    start = time.monotonic()
+    results = download_all(rows, args.flags_folder, args.workers, args.host_rate,
+                           args.retries, args.backoff, manifest=manifest, source_folder=args.sources_folder,
+                           max_age=args.max_age)
+    print_summary(results, time.monotonic() - start)
+    print("Download process completed.")
+
+    start = time.monotonic()
+    rasterized, failed = rasterize_changed(manifest, results["downloaded"], args.raster_workers)
+    print(f"Rasterized {len(rasterized)} flags, {len(failed)} failed, in {time.monotonic() - start:.1f}s.")
+
+    # Repack the bundle the game memory-maps whenever the set of display images changed
+    if rasterized or results["removed"] or not os.path.exists(flag_bundle.bundle_path):
+        count = flag_bundle.build_bundle(args.flags_folder, flag_bundle.bundle_path)
+        print(f"Packed {count} flags into {flag_bundle.bundle_path}.")
+
+def main():
+    run(parse_args())
 
-print("Download process completed.")
+if __name__ == "__main__":
+    main()
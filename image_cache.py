@@ -0,0 +1,61 @@
+import queue
+import threading
+from collections import OrderedDict
+
+# Bounded LRU cache of decoded, display-sized flag images with a background prefetch thread.
+# Only PIL images are stored here; turning them into a PhotoImage must stay on the Tk thread.
+class FlagImageCache:
+    def __init__(self, loader, capacity=32):
+        self.loader = loader  # Function taking a key (a flag name, or a flag name and size) and returning a PIL image
+        self.capacity = capacity
+        self.images = OrderedDict()  # Flag name -> PIL image, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.pending = queue.Queue()
+        self.queued = set()  # Names waiting in the prefetch queue, so they're only loaded once
+        self.worker = threading.Thread(target=self.prefetch_worker, name="flag-prefetch", daemon=True)
+        self.worker.start()
+
+    def get(self, flag_name):
+        with self.lock:
+            img = self.images.get(flag_name)
+            if img is not None:
+                self.images.move_to_end(flag_name)
+                self.hits += 1
+                return img
+            self.misses += 1
+        # Not ready yet (or never prefetched), so load it on the calling thread
+        img = self.loader(flag_name)
+        self.store(flag_name, img)
+        return img
+
+    def prefetch(self, flag_names):
+        with self.lock:
+            for flag_name in flag_names:
+                if flag_name not in self.images and flag_name not in self.queued:
+                    self.queued.add(flag_name)
+                    self.pending.put(flag_name)
+
+    def store(self, flag_name, img):
+        with self.lock:
+            self.images[flag_name] = img
+            self.images.move_to_end(flag_name)
+            while len(self.images) > self.capacity:
+                self.images.popitem(last=False)  # Evict the least recently used image
+
+    def prefetch_worker(self):
+        while True:
+            flag_name = self.pending.get()
+            try:
+                self.store(flag_name, self.loader(flag_name))
+            except Exception as e:
+                print(f"Failed to prefetch {flag_name}: {e}")
+            finally:
+                with self.lock:
+                    self.queued.discard(flag_name)
+                self.pending.task_done()  # Lets callers wait for the prefetches with pending.join()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.images), "capacity": self.capacity, "hits": self.hits, "misses": self.misses}
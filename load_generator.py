@@ -0,0 +1,168 @@
+import os
+import sys
+import json
+import time
+import base64
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+from fuzzy_match import misspell
+from game_server import default_host, read_message, send_message, max_message_size
+from simulate import default_behaviour, percentile, synthetic_catalog
+
+# Load test for game_server.py: many concurrent players connect over WebSockets and play games
+# as fast as the server answers, each leaving after a few questions and starting a new game.
+# Reports sustained sessions and guesses per second, and the round-trip latency of every message.
+# By default it starts its own server on a synthetic catalog; use --port for one already running
+# with the same --flags and --seed.
+
+class LoadStats:
+    def __init__(self):
+        self.sessions = 0
+        self.guesses = 0
+        self.latencies = []
+        self.errors = 0
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind((default_host, 0))
+        return sock.getsockname()[1]
+
+async def connect(host, port):
+    reader, writer = await asyncio.open_connection(host, port, limit=max_message_size)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f"GET /play HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode("latin-1"))
+    response = await reader.readuntil(b"\r\n\r\n")
+    if not response.startswith(b"HTTP/1.1 101"):
+        writer.close()
+        raise ConnectionError(f"WebSocket upgrade refused: {response.splitlines()[0]!r}")
+    return reader, writer
+
+# Send one message and wait for the reply, timing the round trip
+async def request(reader, writer, message, stats):
+    start = time.perf_counter()
+    send_message(writer, message, masked=True)
+    await writer.drain()
+    text = await read_message(reader, writer, masked=True)
+    stats.latencies.append(time.perf_counter() - start)
+    if text is None:
+        raise ConnectionError("The server closed the connection")
+    return json.loads(text)
+
+async def play_game(reader, writer, catalog, names, rng, behaviour, questions, stats):
+    kinds = list(behaviour)
+    weights = list(behaviour.values())
+    reply = await request(reader, writer, {"type": "start"}, stats)
+    for _ in range(questions):
+        if reply["type"] != "question":
+            break
+        flag_name = names[int(reply["image"][len("/images/"):-len(".png")])]
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "correct":
+            guess = rng.choice((flag_name,) + catalog.answers(flag_name))
+        elif kind == "misspelt":
+            guess = misspell(flag_name, rng)
+        elif kind == "empty":
+            guess = ""
+        else:
+            guess = f"{flag_name[::-1]} {rng.randrange(1000)}"  # Not an answer for anything
+
+        reply = await request(reader, writer, {"type": "guess", "text": guess}, stats)
+        stats.guesses += 1
+        if reply["type"] == "result":  # Wrong: register the guess or give up on the flag
+            if kind == "register" and guess:
+                reply = await request(reader, writer, {"type": "register", "text": guess}, stats)
+            else:
+                reply = await request(reader, writer, {"type": "skip"}, stats)
+    if reply["type"] != "end":
+        await request(reader, writer, {"type": "quit"}, stats)
+    stats.sessions += 1
+
+# One simulated player: keeps starting new games on the same connection until the deadline
+async def player(host, port, catalog, names, rng, behaviour, questions, deadline, stats):
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await connect(host, port)
+        except (OSError, ConnectionError):
+            stats.errors += 1
+            await asyncio.sleep(0.1)
+            continue
+        try:
+            while time.monotonic() < deadline:
+                await play_game(reader, writer, catalog, names, rng, behaviour, questions, stats)
+        except (OSError, ConnectionError, ValueError, KeyError, asyncio.IncompleteReadError):
+            stats.errors += 1
+        finally:
+            writer.close()
+
+async def wait_for_server(host, port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+async def fetch_stats(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET /stats HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n".encode("latin-1"))
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+async def run(host, port, catalog, players, duration, questions, seed):
+    await wait_for_server(host, port)
+    names = catalog.playable_names()  # Same order as the server's, so image numbers map to names
+    stats = LoadStats()
+    deadline = time.monotonic() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(player(host, port, catalog, names, random.Random(seed + index), default_behaviour,
+                                  questions, deadline, stats) for index in range(players)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(stats.latencies)
+    print(f"{players} concurrent players for {elapsed:.1f}s: {stats.sessions} games "
+          f"({stats.sessions / elapsed:.1f} sessions/sec), {stats.guesses} guesses ({stats.guesses / elapsed:.0f} guesses/sec), "
+          f"{len(latencies) / elapsed:.0f} messages/sec, {stats.errors} errors")
+    print(f"  round trip  p50 {percentile(latencies, 0.5) * 1000:.2f} ms  p95 {percentile(latencies, 0.95) * 1000:.2f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms")
+    print(f"  server: {await fetch_stats(host, port)}")
+    return stats
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test game_server.py with many concurrent simulated players")
+    parser.add_argument("--players", type=int, default=200, help="Number of concurrent connections")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to keep playing")
+    parser.add_argument("--questions", type=int, default=20, help="Questions answered before starting a new game")
+    parser.add_argument("--flags", type=int, default=2000, help="Size of the synthetic catalog")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default=default_host)
+    parser.add_argument("--port", type=int, help="Port of a running server started with --synthetic (default: start one)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    catalog = synthetic_catalog(args.flags, args.seed)
+    server = None
+    port = args.port
+    if port is None:
+        port = free_port()
+        server_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "game_server.py")
+        server = subprocess.Popen([sys.executable, server_script, "--synthetic", str(args.flags),
+                                   "--seed", str(args.seed), "--host", args.host, "--port", str(port)])
+    try:
+        asyncio.run(run(args.host, port, catalog, args.players, args.duration, args.questions, args.seed))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
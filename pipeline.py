@@ -0,0 +1,197 @@
+import os
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import wiki_flags
+import get_images
+import rasterize
+import flag_bundle
+import flag_duplicates
+
+# One command for every stage: scrape the flag list, download the images, render them, pack
+# the bundle and play. "all" runs the build stages as a pipeline connected by queues: image
+# downloads start as soon as the first page is scraped, and each downloaded flag is handed to
+# the rasterizer processes straight away, so a full rebuild takes about as long as the slowest
+# stage instead of all of them added up.
+
+end_of_rows = object()  # Put on the rows queue once the scraper has written all_flags.csv
+
+# Runs on its own thread: queues (flag name, image url) rows as each page is cleaned, then
+# writes all_flags.csv with every page in the usual order. Errors are passed along the queue.
+# Pages that couldn't be fetched are listed in missing, and all_flags.csv is then left as it was.
+def scrape_rows(rows_queue, cache_dir, offline, output, missing):
+    try:
+        frames = {}
+        for page, frame in wiki_flags.stream_flags(cache_dir, offline):
+            if frame is None:
+                missing.append(page)
+                continue
+            frames[page] = frame
+            for flag_name, image_url in zip(frame['Name'], frame['URL']):
+                if isinstance(image_url, str) and image_url:  # Rows without a URL are skipped, like read_flag_rows
+                    rows_queue.put((flag_name, image_url))
+        if not missing:
+            wiki_flags.save_flags(wiki_flags.combine_pages(frames), output)
+        rows_queue.put(end_of_rows)
+    except Exception as e:
+        rows_queue.put(e)
+
+def queued_rows(rows_queue):
+    while True:
+        item = rows_queue.get()
+        if item is end_of_rows:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+def run_all(args):
+    start = time.monotonic()
+    manifest = get_images.FlagManifest(get_images.manifest_path_for(args.flags_folder))
+    if args.force:
+        manifest.entries = {}
+
+    rows_queue = queue.Queue()
+    missing = []  # Source pages the scrape couldn't fetch
+    scraper = threading.Thread(target=scrape_rows, args=(rows_queue, args.cache_dir, args.offline, args.output, missing),
+                               name="scraper", daemon=True)
+    scraper.start()
+
+    wanted_names = set()  # Every flag in the new all_flags.csv, for removing the ones that are gone
+
+    def tracked(rows):
+        for flag_name, image_url in rows:
+            wanted_names.add(flag_name)
+            yield flag_name, image_url
+
+    results = {"downloaded": [], "unchanged": [], "failed": [], "removed": []}
+    rasterized = []
+    raster_failed = []
+    with ProcessPoolExecutor(max_workers=args.raster_workers or os.cpu_count() or 1) as raster_pool:
+        raster_jobs = {}  # Future -> (source path, output path)
+        rendering = {}  # Source path -> output path of the first flag rendered from it
+        busy_outputs = set()  # Output paths a render has been started for
+        targets = {}  # Output path -> source path it has to end up rendered from
+        downloads = get_images.download_stream(tracked(queued_rows(rows_queue)), args.flags_folder, args.workers,
+                                               args.host_rate, args.retries, args.backoff, manifest=manifest,
+                                               source_folder=args.sources_folder, max_age=args.max_age)
+        for flag_name, outcome, error in downloads:
+            results[outcome].append((flag_name, error) if outcome == "failed" else flag_name)
+            entry = manifest.get(flag_name)
+            # Render new downloads, and unchanged ones missing any of their sizes
+            if outcome == "downloaded" or (outcome == "unchanged" and rasterize.needs_render(entry["output_path"])):
+                os.makedirs(os.path.dirname(entry["output_path"]) or ".", exist_ok=True)
+                # A name listed twice with different URLs comes through twice; the later one is
+                # what the manifest keeps, so it's the one the flag must end up rendered from
+                targets[entry["output_path"]] = entry["source_path"]
+                # Start at most one render per source and per output (two processes must never
+                # write the same file); the rest are copied or rendered below
+                if entry["source_path"] in rendering or entry["output_path"] in busy_outputs:
+                    continue
+                future = raster_pool.submit(rasterize.rasterize_flag, entry["source_path"], entry["output_path"])
+                rendering[entry["source_path"]] = entry["output_path"]
+                busy_outputs.add(entry["output_path"])
+                raster_jobs[future] = (entry["source_path"], entry["output_path"])
+        downloaded_at = time.monotonic()
+
+        rendered = {}  # Output path -> source path it now holds
+        failed_sources = {}  # Source path -> error, for sources that couldn't be rendered
+        for future, (source_path, output_path) in raster_jobs.items():
+            try:
+                future.result()
+                rendered[output_path] = source_path
+            except Exception as e:
+                print(f"Failed to rasterize {output_path}: {e}")
+                raster_failed.append((output_path, str(e)))
+                failed_sources[source_path] = str(e)
+
+        # Flags not rendered from their own source yet: copy from a flag that already has it, or
+        # render it now. Copies only read outputs that are final and only write ones that aren't.
+        pending = {output_path: source_path for output_path, source_path in targets.items()
+                   if rendered.get(output_path) != source_path and rendering.get(source_path) != output_path}
+        rasterized.extend(output_path for output_path in targets if output_path not in pending and output_path in rendered)
+        second_jobs = {}
+        for output_path, source_path in pending.items():
+            first = rendering.get(source_path)
+            if source_path in failed_sources:
+                raster_failed.append((output_path, failed_sources[source_path]))
+            elif first is not None and first not in pending and rendered.get(first) == source_path:
+                rasterized.append(rasterize.copy_rendered(first, output_path))
+            else:
+                second_jobs[raster_pool.submit(rasterize.rasterize_flag, source_path, output_path)] = output_path
+        for future, output_path in second_jobs.items():
+            try:
+                future.result()
+                rasterized.append(output_path)
+            except Exception as e:
+                print(f"Failed to rasterize {output_path}: {e}")
+                raster_failed.append((output_path, str(e)))
+    scraper.join()
+
+    if missing:
+        # Flags from the missing pages aren't in wanted_names, but they haven't gone from Wikipedia
+        print(f"Could not fetch {', '.join(missing)}: kept {args.output} and skipped removing stale flags.")
+    else:
+        results["removed"] = get_images.remove_stale_flags(manifest, wanted_names)
+    manifest.save()
+    get_images.print_summary(results, downloaded_at - start)
+    print(f"Rasterized {len(rasterized)} flags, {len(raster_failed)} failed, "
+          f"finished {time.monotonic() - downloaded_at:.1f}s after the last download.")
+
+    if rasterized or results["removed"] or not os.path.exists(flag_bundle.bundle_path):
+        count = flag_bundle.build_bundle(args.flags_folder, flag_bundle.bundle_path)
+        print(f"Packed {count} flags into {flag_bundle.bundle_path}.")
+    print(f"Rebuilt the catalog in {time.monotonic() - start:.1f}s.")
+
+def run_play(args):
+    import game  # Only the game needs tkinter
+    game.run(game.parse_args(args.game_args))
+
+def add_all_arguments(parser):
+    parser.add_argument("--offline", action="store_true", help="Scrape the cached pages without using the network")
+    parser.add_argument("--cache-dir", default=wiki_flags.cache_folder, help="Folder for cached Wikipedia pages")
+    parser.add_argument("--output", default=wiki_flags.output_path, help="CSV file the scraped flags are written to")
+    parser.add_argument("--flags-folder", default=get_images.flags_folder, help="Folder the display PNG files are written to")
+    parser.add_argument("--sources-folder", default=get_images.sources_folder, help="Folder the original downloads are kept in")
+    parser.add_argument("--workers", type=int, default=get_images.default_workers, help="Number of parallel downloads")
+    parser.add_argument("--host-rate", type=float, default=get_images.default_host_rate,
+                        help="Maximum requests per second per host (0 disables the limit)")
+    parser.add_argument("--retries", type=int, default=get_images.default_retries, help="Retries for transient errors")
+    parser.add_argument("--backoff", type=float, default=get_images.default_backoff, help="Base retry delay in seconds")
+    parser.add_argument("--raster-workers", type=int, default=None,
+                        help="Number of processes converting images (default: CPU count)")
+    parser.add_argument("--max-age", type=float, default=get_images.default_max_age,
+                        help="Seconds before a downloaded flag is checked for changes again (0 checks every flag)")
+    parser.add_argument("--force", action="store_true", help="Ignore the manifest and download every flag again")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the flag catalog and play the game")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Each stage takes the same options as its own script
+    for name, module, help_text in (("scrape", wiki_flags, "Scrape flag names and image URLs into all_flags.csv"),
+                                    ("fetch", get_images, "Download the flags in all_flags.csv and render changed ones"),
+                                    ("rasterize", rasterize, "Render every downloaded flag at the display size"),
+                                    ("build-index", flag_bundle, "Pack the display images into the flag bundle"),
+                                    ("find-duplicates", flag_duplicates, "Group flags that look the same into one question")):
+        command = commands.add_parser(name, help=help_text)
+        module.add_arguments(command)
+        command.set_defaults(run=module.run)
+
+    command = commands.add_parser("play", help="Start the game (options such as --profile-startup are passed on)")
+    command.add_argument("game_args", nargs=argparse.REMAINDER)
+    command.set_defaults(run=run_play)
+
+    command = commands.add_parser("all", help="Scrape, download, render and pack as one streaming pipeline")
+    add_all_arguments(command)
+    command.set_defaults(run=run_all)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import io
+import os
+import json
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+from flag_bundle import display_size, variant_sizes, variant_format, fit_size, variant_path_for, variant_paths_for
+
+# Folder holding the original downloaded files (SVG, PNG, JPG) and the folder the game reads
+sources_folder = "flag_sources"
+flags_folder = "flags"
+manifest_path = "flags_manifest.json"  # Written by get_images.py; says which source file each flag uses
+
+# Decode a source file once, big enough for the largest size. SVGs are drawn by cairo at the
+# largest box width (cairo keeps their aspect ratio), and every size is scaled down from that.
+# cairosvg is only imported for SVGs, so downloading and everything else works without libcairo.
+def load_source(source_path, sizes=variant_sizes):
+    if source_path.lower().endswith('.svg'):
+        from cairosvg import svg2png
+        png = svg2png(url=source_path, output_width=max(width for width, _ in sizes))
+        img = Image.open(io.BytesIO(png))
+    else:
+        img = Image.open(source_path)
+    return img.convert("RGBA")
+
+# Render one source file into every size box, keeping the flag's shape: the display size as the
+# PNG at output_path and the others as lossless WebP beside it. Runs inside a worker process,
+# so it must stay a plain module-level function that only takes picklable arguments.
+def rasterize_flag(source_path, output_path, sizes=variant_sizes):
+    img = load_source(source_path, sizes)
+    for box in sorted(sizes, reverse=True):
+        size = fit_size(img.size, box)
+        # Each size is scaled from the one above it. A small bitmap is only scaled up to the
+        # display size; the bigger boxes keep it as it is.
+        if size[0] < img.width or tuple(box) == display_size:
+            img = img.resize(size, Image.LANCZOS)
+        path = variant_path_for(output_path, box)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = path + ".part"
+        if tuple(box) == display_size:
+            img.save(temp_path, format="PNG", optimize=True)
+        else:
+            img.save(temp_path, format=variant_format, lossless=True)
+        os.replace(temp_path, path)
+    return output_path
+
+# Whether a flag still has to be rendered at some size (flags rendered before the extra sizes
+# existed only have their display PNG)
+def needs_render(output_path):
+    return not all(os.path.exists(path) for path in variant_paths_for(output_path))
+
+# Copy a rendered flag, at every size, for another flag that uses the same source file
+def copy_rendered(rendered_path, output_path):
+    for rendered, output in zip(variant_paths_for(rendered_path), variant_paths_for(output_path)):
+        if not os.path.exists(rendered):
+            continue
+        os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+        temp_path = output + ".part"
+        shutil.copyfile(rendered, temp_path)
+        os.replace(temp_path, output)
+    return output_path
+
+# Rasterize (source_path, output_path) jobs on a process pool; returns (succeeded, failed) lists.
+# Flags sharing a source file are rendered once and the images are copied for the others.
+def rasterize_all(jobs, workers=None, sizes=variant_sizes):
+    succeeded = []
+    failed = []
+    if not jobs:
+        return succeeded, failed
+
+    outputs = {}  # Source path -> every output path rendered from it
+    for source_path, output_path in jobs:
+        outputs.setdefault(source_path, []).append(output_path)
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(rasterize_flag, source_path, output_paths[0], sizes): output_paths
+                   for source_path, output_paths in outputs.items()}
+        for future, output_paths in futures.items():
+            try:
+                rendered_path = future.result()
+                for output_path in output_paths[1:]:
+                    copy_rendered(rendered_path, output_path)
+                succeeded.extend(output_paths)
+            except Exception as e:
+                print(f"Failed to rasterize {output_paths[0]}: {e}")
+                failed.extend((output_path, str(e)) for output_path in output_paths)
+    return succeeded, failed
+
+# Pair every source file in the download manifest with the PNG the game will load
+def jobs_for_manifest(manifest_path):
+    with open(manifest_path, mode='r', encoding='utf-8') as file:
+        entries = json.load(file)
+    return [(entry["source_path"], entry["output_path"]) for flag_name, entry in sorted(entries.items())
+            if entry.get("source_path") and os.path.exists(entry["source_path"])]
+
+# Pair every downloaded source file with the PNG the game will load, for sources named after
+# their flag (downloads made before sources were stored by content hash)
+def jobs_for_folder(source_folder, output_folder):
+    jobs = []
+    for filename in sorted(os.listdir(source_folder)):
+        flag_name, extension = os.path.splitext(filename)
+        if extension.lower() in ('.svg', '.png', '.jpg', '.jpeg', '.gif', '.webp'):
+            jobs.append((os.path.join(source_folder, filename), os.path.join(output_folder, f"{flag_name}.png")))
+    return jobs
+
+# Time the stage with different worker counts and report images/sec for each
+def benchmark(jobs, worker_counts, output_folder):
+    results = {}
+    bench_jobs = [(source_path, os.path.join(output_folder, os.path.basename(output_path)))
+                  for source_path, output_path in jobs]
+    os.makedirs(output_folder, exist_ok=True)
+    for workers in worker_counts:
+        start = time.perf_counter()
+        succeeded, _ = rasterize_all(bench_jobs, workers)
+        elapsed = time.perf_counter() - start
+        results[workers] = len(succeeded) / elapsed if elapsed else 0.0
+        print(f"{workers:>3} workers: {len(succeeded)} images in {elapsed:.2f}s ({results[workers]:.1f} images/sec)")
+    return results
+
+def add_arguments(parser):
+    parser.add_argument("--sources-folder", default=sources_folder, help="Folder with the downloaded originals")
+    parser.add_argument("--flags-folder", default=flags_folder, help="Folder the display PNGs are written to")
+    parser.add_argument("--manifest", default=manifest_path,
+                        help="Download manifest mapping flags to their source files (falls back to the sources folder)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: CPU count)")
+    parser.add_argument("--benchmark", metavar="COUNTS",
+                        help="Comma separated worker counts to time, e.g. 1,2,4,8 (writes to a scratch folder)")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Render downloaded flag images at the game's display sizes")
+    add_arguments(parser)
+    return parser.parse_args()
+
+def run(args):
+    if os.path.exists(args.manifest):
+        jobs = jobs_for_manifest(args.manifest)
+    else:
+        jobs = jobs_for_folder(args.sources_folder, args.flags_folder)
+
+    if args.benchmark:
+        worker_counts = [int(count) for count in args.benchmark.split(',')]
+        benchmark(jobs, worker_counts, args.flags_folder + "_benchmark")
+        return
+
+    os.makedirs(args.flags_folder, exist_ok=True)
+    start = time.perf_counter()
+    succeeded, failed = rasterize_all(jobs, args.workers)
+    print(f"Rasterized {len(succeeded)} flags, {len(failed)} failed, in {time.perf_counter() - start:.1f}s.")
+
+def main():
+    run(parse_args())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+from answer_registry import AnswerRegistry
+from flag_catalog import FlagCatalog, FlagRecord
+from fuzzy_match import synthetic_names, misspell, confusable_names, confusable_accepts
+from flag_scheduler import make_deck, modes
+from flag_stats import FlagStats
+from game_engine import FlagGameEngine, GameData, load_game_data
+
+# Load test for the headless game engine: many simulated players each play a game,
+# answering correctly, wrongly, with typos, or registering new answers, and the time taken by
+# every engine call is recorded.
+
+# How likely each kind of answer is for a simulated player
+default_behaviour = {"correct": 0.6, "misspelt": 0.15, "wrong": 0.15, "register": 0.05, "empty": 0.05}
+
+def synthetic_catalog(count, seed=0):
+    rng = random.Random(seed)
+    records = []
+    for name in synthetic_names(count, seed):
+        # Give some flags an alternative answer, like valid_answers.csv does
+        answers = (name.split()[0],) if " " in name and rng.random() < 0.3 else ()
+        records.append(FlagRecord(name, answers, True))
+    # Real names that start like each other, so typing one on the other's flag gets exercised
+    records.extend(FlagRecord(name, (), True) for name in sorted({name for pair in confusable_names for name in pair}))
+    return FlagCatalog(records)
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+# Play one game, appending the seconds each engine call took to timings
+def play_game(data, rng, behaviour, timings, questions=None, mode=None, stats=None):
+    deck = make_deck(mode, data.catalog.playable_names(), stats, rng) if mode else None
+    engine = FlagGameEngine(data, rng, deck=deck, stats=stats)
+    kinds = list(behaviour)
+    weights = list(behaviour.values())
+    asked = 0
+    while questions is None or asked < questions:
+        start = time.perf_counter()
+        flag_name = engine.next_flag()
+        timings["next_flag"].append(time.perf_counter() - start)
+        if flag_name is None:
+            break
+        asked += 1
+
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "correct":
+            guess = rng.choice((flag_name,) + data.answers.answers(flag_name))
+        elif kind == "misspelt":
+            guess = misspell(flag_name, rng)
+        elif kind == "empty":
+            guess = ""
+        else:
+            guess = f"{flag_name[::-1]} {rng.randrange(1000)}"  # Not an answer for anything
+
+        # The UI checks the text after every keystroke, then once more when it's submitted
+        for length in range(1, len(guess) + 1):
+            start = time.perf_counter()
+            correct = engine.is_correct(guess[:length], partial=True)
+            timings["keystroke"].append(time.perf_counter() - start)
+            if correct:
+                break
+
+        start = time.perf_counter()
+        correct = engine.check_guess(guess)
+        timings["check_guess"].append(time.perf_counter() - start)
+
+        if not correct and kind == "register" and guess:
+            start = time.perf_counter()
+            engine.closest_answers(guess)
+            engine.register_answer(guess)
+            timings["register_answer"].append(time.perf_counter() - start)
+    engine.end_game()
+    return engine
+
+# With a mode, every game is drawn by the scheduler and records into one shared FlagStats, as if
+# the same player kept coming back
+def run(data, players, seed, behaviour, questions, mode=None):
+    rng = random.Random(seed)
+    stats = FlagStats(None) if mode else None
+    timings = {"next_flag": [], "keystroke": [], "check_guess": [], "register_answer": []}
+    scores = []
+    start = time.perf_counter()
+    for _ in range(players):
+        engine = play_game(data, rng, behaviour, timings, questions, mode, stats)
+        scores.append(engine.score / max(engine.current_question, 1))
+    elapsed = time.perf_counter() - start
+
+    print(f"{players} games ({len(data.catalog)} flags) in {elapsed:.2f}s: {players / elapsed:.1f} games/sec, "
+          f"mean score {sum(scores) / len(scores) * 100:.1f}%")
+    for operation, values in timings.items():
+        values.sort()
+        if values:
+            print(f"  {operation:<16} {len(values):>9} calls  p50 {percentile(values, 0.5) * 1e6:8.1f} us  "
+                  f"p95 {percentile(values, 0.95) * 1e6:8.1f} us  p99 {percentile(values, 0.99) * 1e6:8.1f} us")
+
+    names = set(data.catalog.playable_names())
+    pairs = [(flag_name, typed) for flag_name, typed in confusable_names if flag_name in names and typed in names]
+    wrong = confusable_accepts(data.matcher, pairs)
+    print(f"  {len(wrong)}/{len(pairs)} other countries' names accepted while typing"
+          + "".join(f"; {flag_name}: '{text}'" for flag_name, text in wrong))
+    return elapsed, timings
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulate many players against the headless game engine")
+    parser.add_argument("--players", type=int, default=1000, help="Number of games to play")
+    parser.add_argument("--flags", type=int, default=200, help="Size of the synthetic catalog")
+    parser.add_argument("--questions", type=int, default=20,
+                        help="Stop each game after this many questions (0 plays every flag)")
+    parser.add_argument("--real", action="store_true", help="Use csv/valid_answers.csv and flags/ instead")
+    parser.add_argument("--save", action="store_true",
+                        help="Save registered answers through an AnswerRegistry in a temporary folder")
+    parser.add_argument("--mode", choices=modes, help="Order questions with the weighted scheduler in this mode")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    registry = None
+    if args.save:
+        registry = AnswerRegistry(os.path.join(tempfile.mkdtemp(), "valid_answers.csv"))
+
+    if args.real:
+        data = load_game_data("flags", "csv/valid_answers.csv", registry=registry)
+    else:
+        data = GameData(synthetic_catalog(args.flags, args.seed), registry)
+    try:
+        run(data, args.players, args.seed, default_behaviour, args.questions or None, args.mode)
+    finally:
+        data.close()
+
+if __name__ == "__main__":
+    main()
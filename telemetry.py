@@ -0,0 +1,127 @@
+import json
+import math
+import time
+import threading
+import functools
+
+# Opt-in timing of the game's hot paths. When telemetry is off nothing is wrapped at all, so the
+# cost is zero; when it's on, chosen methods of an object are replaced (on that instance only)
+# by wrappers that record how long each call took into a histogram.
+#
+# Histograms use fixed buckets growing by a factor of sqrt(2) from 1 microsecond, so recording is
+# O(1) with bounded memory however long the game runs, and percentiles are accurate to within
+# one bucket. Reports are JSON or Prometheus text (which uses the same buckets).
+
+bucket_factor = math.sqrt(2)
+smallest_bucket = 1e-6  # Seconds
+bucket_count = 64  # Up to about 2 hours
+
+bucket_bounds = [smallest_bucket * bucket_factor ** index for index in range(bucket_count)]
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (bucket_count + 1)  # The last bucket takes anything bigger
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        if seconds <= smallest_bucket:
+            bucket = 0
+        else:
+            bucket = min(bucket_count, math.ceil(math.log(seconds / smallest_bucket, bucket_factor)))
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    # Estimated value below which the given fraction of calls fell: the geometric middle of the
+    # bucket it lands in, kept within the smallest and largest values seen
+    def percentile(self, fraction):
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                upper = bucket_bounds[bucket] if bucket < bucket_count else self.max
+                estimate = upper / math.sqrt(bucket_factor)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "mean_ms": self.total / max(self.count, 1) * 1000,
+                "p50_ms": self.percentile(0.5) * 1000, "p95_ms": self.percentile(0.95) * 1000,
+                "p99_ms": self.percentile(0.99) * 1000, "max_ms": (self.max or 0.0) * 1000}
+
+class Telemetry:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}  # Operation name -> Histogram
+        self.lock = threading.Lock()  # Some operations run on background threads
+        self.started = time.time()
+
+    def record(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds)
+
+    # Time a function under the given name (returns it unchanged when telemetry is off)
+    def timed(self, name, func):
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+        return wrapper
+
+    # Time methods of one object, given as {method name: operation name}. Do this before the
+    # methods are handed out as callbacks, since those keep a reference to what they were given.
+    def instrument(self, obj, methods):
+        if not self.enabled:
+            return
+        for method, name in methods.items():
+            setattr(obj, method, self.timed(name, getattr(obj, method)))
+
+    def summary(self):
+        with self.lock:
+            return {name: histogram.summary() for name, histogram in sorted(self.histograms.items())}
+
+    # One line per operation for the debug overlay
+    def overlay_text(self):
+        return "\n".join(f"{name}: n={stats['count']} p50 {stats['p50_ms']:.2f} p95 {stats['p95_ms']:.2f} "
+                         f"p99 {stats['p99_ms']:.2f} ms" for name, stats in self.summary().items())
+
+    def report_json(self):
+        return json.dumps({"started": self.started, "duration_seconds": time.time() - self.started,
+                           "operations": self.summary()}, indent=2)
+
+    def report_prometheus(self, metric="flag_game_operation_seconds"):
+        lines = [f"# HELP {metric} Time taken by game operations.", f"# TYPE {metric} histogram"]
+        with self.lock:
+            for name, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(bucket_bounds, histogram.counts):
+                    cumulative += count
+                    if count:  # Empty buckets are left out; the cumulative counts stay correct
+                        lines.append(f'{metric}_bucket{{operation="{name}",le="{bound:.6g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{operation="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{operation="{name}"}} {histogram.total:.9f}')
+                lines.append(f'{metric}_count{{operation="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    # Write the report as Prometheus text if the path ends in .prom or .txt, otherwise as JSON
+    def write_report(self, path):
+        text = self.report_prometheus() if path.endswith((".prom", ".txt")) else self.report_json()
+        with open(path, mode='w', encoding='utf-8') as file:
+            file.write(text)
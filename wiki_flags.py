@@ -1,30 +1,190 @@
 import os
+import re
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
 from bs4 import BeautifulSoup
 import pandas as pd
 
-# Initialize an empty DataFrame to hold all flags data
-all_flags_df = pd.DataFrame()
+# lxml builds the tree much faster than the pure-Python parser; use it when it's installed
+try:
+    import lxml  # noqa: F401
+    parser_backend = 'lxml'
+except ImportError:
+    parser_backend = 'html.parser'
+
+# Wikipedia pages the flags are scraped from
+sovereign_states_url = "https://en.wikipedia.org/wiki/List_of_national_flags_of_sovereign_states"
+city_flags_url = 'https://en.wikipedia.org/wiki/Lists_of_city_flags'
+dependent_territories_url = 'https://en.wikipedia.org/wiki/Gallery_of_flags_of_dependent_territories'
+
+# Name used for each page in the cache folder
+source_pages = {
+    'sovereign_states': sovereign_states_url,
+    'city_flags': city_flags_url,
+    'dependent_territories': dependent_territories_url,
+}
+
+output_path = 'csv/all_flags.csv'
+cache_folder = 'cache/pages'  # Last copy of every page, with the headers needed to revalidate it
+
+headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.66 Safari/537.36"
+}
+
+def cached_page_paths(folder, page):
+    return os.path.join(folder, f"{page}.html"), os.path.join(folder, f"{page}.json")
+
+def read_cached_page(folder, page):
+    html_path, meta_path = cached_page_paths(folder, page)
+    if not os.path.exists(html_path):
+        return None, {}
+    with open(html_path, 'rb') as file:
+        html = file.read()
+    meta = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, mode='r', encoding='utf-8') as file:
+            meta = json.load(file)
+    return html, meta
+
+def write_cached_page(folder, page, html, meta):
+    os.makedirs(folder, exist_ok=True)
+    html_path, meta_path = cached_page_paths(folder, page)
+    for path, data, mode in ((html_path, html, 'wb'), (meta_path, json.dumps(meta, indent=1), 'w')):
+        with open(path + '.tmp', mode) as file:
+            file.write(data)
+        os.replace(path + '.tmp', path)
+
+# Fetch one page, revalidating the cached copy with If-None-Match/If-Modified-Since. If the
+# request fails the cached copy is used instead; offline mode never touches the network.
+def fetch_page(session, page, url, folder=cache_folder, offline=False):
+    html, meta = read_cached_page(folder, page)
+    if offline:
+        if html is None:
+            raise FileNotFoundError(f"No cached copy of {page} in {folder}")
+        return html
+
+    request_headers = {}
+    if html is not None and meta.get('url') == url:
+        if meta.get('etag'):
+            request_headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            request_headers['If-Modified-Since'] = meta['last_modified']
+    try:
+        response = session.get(url, headers=request_headers, timeout=30)
+        if response.status_code == 304:
+            return html
+        response.raise_for_status()
+    except requests.RequestException as e:
+        if html is None:
+            raise
+        print(f"Failed to fetch {url} ({e}), using the cached copy")
+        return html
+
+    write_cached_page(folder, page, response.content, {
+        'url': url,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    })
+    return response.content
+
+def create_session():
+    session = requests.Session()
+    session.headers.update(headers)
+    return session
+
+# Fetch all source pages at once over one session; a page that can't be fetched (and isn't
+# cached) is reported and returned as None instead of stopping the other fetches
+def fetch_pages(folder=cache_folder, offline=False):
+    session = create_session()
+    pages = {}
+    with ThreadPoolExecutor(max_workers=len(source_pages)) as executor:
+        futures = {page: executor.submit(fetch_page, session, page, url, folder, offline)
+                   for page, url in source_pages.items()}
+        for page, future in futures.items():
+            try:
+                pages[page] = future.result()
+            except Exception as e:
+                print(f"Skipping {page}: {e}")
+                pages[page] = None
+    return pages
+
+void_tags = {'img', 'br', 'hr', 'meta', 'link', 'input', 'source'}
+attribute_text = rb'''(?:[^>"']|"[^"]*"|'[^']*')*'''  # Everything up to a tag's closing '>', quotes and all
+class_attribute = re.compile(rb'''\bclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))''', re.IGNORECASE)
+
+# The slices of a page (bytes) holding every <tag> element, only those with class_name among their
+# classes if it's given. Closing tags are matched by depth so nested elements of the same tag stay
+# whole; an element that is never closed takes the rest of the page. Void tags are just the tag.
+def element_regions(html, tag, class_name=None):
+    name = re.escape(tag.encode('ascii'))
+    opening = re.compile(rb'<' + name + rb'\b' + attribute_text + rb'>', re.IGNORECASE)
+    boundary = re.compile(rb'<(/?)' + name + rb'\b' + attribute_text + rb'>', re.IGNORECASE)
+    wanted = class_name.encode('ascii') if class_name else None
+    regions = []
+    position = 0
+    while True:
+        match = opening.search(html, position)
+        if match is None:
+            return regions
+        position = match.end()
+        if wanted:
+            classes = class_attribute.search(match.group())
+            if not classes or wanted not in next(value for value in classes.groups() if value is not None).split():
+                continue
+        if tag in void_tags:
+            regions.append(match.group())
+            continue
+        depth = 1
+        end = len(html)
+        for boundary_match in boundary.finditer(html, position):
+            depth += -1 if boundary_match.group(1) else 1
+            if depth == 0:
+                end = boundary_match.end()
+                break
+        regions.append(html[match.start():end])
+        position = end
+
+# Each source page has an extractor that only parses the parts of the page holding flags. Those
+# elements (region) are cut out of the raw HTML with element_regions before any tree is built, so
+# parse time and memory follow the number of flags rather than the page size.
+# Add a page by subclassing PageExtractor and registering it in page_extractors.
+class PageExtractor:
+    region = None  # (tag, class name or None) of the elements extract() needs
+
+    def parse(self, html, targeted=True, backend=None):
+        if isinstance(html, str):
+            html = html.encode('utf-8')
+        if targeted and self.region:
+            html = b''.join(element_regions(html, *self.region))
+        soup = BeautifulSoup(html, backend or parser_backend, from_encoding='utf-8')  # Wikipedia serves UTF-8
+        return self.extract(soup)
+
+    def extract(self, soup):
+        raise NotImplementedError
 
 # SCRIPT 1: Sovereign States Flags
-url1 = "https://en.wikipedia.org/wiki/List_of_national_flags_of_sovereign_states"
-response1 = requests.get(url1)
-soup1 = BeautifulSoup(response1.content, 'html.parser')
-table1 = soup1.find('table', {'class': 'wikitable'})
-country_names = []
-flag_images = []
-
-for row in table1.find_all('tr')[1:]:  # Skip header row
-    cols = row.find_all('td')
-    if len(cols) > 1:
-        country_name = cols[0].text.strip()
-        image = cols[0].find('img')
-        flag_image_url = "https:" + image['src'] if image else None
-        country_names.append(country_name)
-        flag_images.append(flag_image_url)
-
-flags_df1 = pd.DataFrame({'Name': country_names, 'URL': flag_images})
-all_flags_df = pd.concat([all_flags_df, flags_df1], ignore_index=True)
+class SovereignStatesExtractor(PageExtractor):
+    region = ('table', 'wikitable')
+
+    def extract(self, soup1):
+        table1 = soup1.find('table', {'class': 'wikitable'})
+        country_names = []
+        flag_images = []
+
+        for row in table1.find_all('tr')[1:]:  # Skip header row
+            cols = row.find_all('td')
+            if len(cols) > 1:
+                country_name = cols[0].text.strip()
+                image = cols[0].find('img')
+                flag_image_url = "https:" + image['src'] if image else None
+                country_names.append(country_name)
+                flag_images.append(flag_image_url)
+
+        return pd.DataFrame({'Name': country_names, 'URL': flag_images})
 
 # SCRIPT 2: Micronations Flags
 # url2 = "https://en.wikipedia.org/wiki/Flags_of_micronations"
@@ -45,73 +205,69 @@ all_flags_df = pd.concat([all_flags_df, flags_df1], ignore_index=True)
 # all_flags_df = pd.concat([all_flags_df, flags_df2], ignore_index=True)
 
 # SCRIPT 3: City Flags
-url3 = 'https://en.wikipedia.org/wiki/Lists_of_city_flags'
-response3 = requests.get(url3)
-soup3 = BeautifulSoup(response3.text, 'html.parser')
-city_names = []
-flag_urls = []
-
-flags3 = soup3.find_all('img')
-for img in flags3:
-    flag_url = 'https:' + img['src']
-    city_name = img.get('alt', 'No name')
-    city_names.append(city_name)
-    flag_urls.append(flag_url)
-
-flags_df3 = pd.DataFrame({'Name': city_names, 'URL': flag_urls})
-all_flags_df = pd.concat([all_flags_df, flags_df3], ignore_index=True)
+class CityFlagsExtractor(PageExtractor):
+    region = ('img', None)
+
+    def extract(self, soup3):
+        city_names = []
+        flag_urls = []
+
+        flags3 = soup3.find_all('img')
+        for img in flags3:
+            flag_url = 'https:' + img['src']
+            city_name = img.get('alt', 'No name')
+            city_names.append(city_name)
+            flag_urls.append(flag_url)
+
+        return pd.DataFrame({'Name': city_names, 'URL': flag_urls})
 
 # SCRIPT 4: Dependent Territories Flags
-url4 = 'https://en.wikipedia.org/wiki/Gallery_of_flags_of_dependent_territories'
-response4 = requests.get(url4)
-soup4 = BeautifulSoup(response4.content, 'html.parser')
-gallery_items = soup4.find_all('li', class_='gallerybox')
-names = []
-image_urls = []
-
-for item in gallery_items:
-    img_tag = item.find('img')
-    if img_tag:
-        img_url = 'https:' + img_tag['src']
-        image_urls.append(img_url)
-        text_div = item.find('div', class_='gallerytext')
-        if text_div:
-            flag_text = text_div.get_text(strip=True)
-            names.append(flag_text)  # Capture the entire text
-        else:
-            names.append(None)
-    else:
-        image_urls.append(None)
+class DependentTerritoriesExtractor(PageExtractor):
+    region = ('li', 'gallerybox')
+
+    def extract(self, soup4):
+        gallery_items = soup4.find_all('li', class_='gallerybox')
+        names = []
+        image_urls = []
 
-# Add additonal flags not found on wiki page
-names.append('Guadeloupe (unofficial)')
-image_urls.append('https://upload.wikimedia.org/wikipedia/commons/e/e7/Unofficial_flag_of_Guadeloupe_%28local%29.svg')
+        for item in gallery_items:
+            img_tag = item.find('img')
+            if img_tag:
+                img_url = 'https:' + img_tag['src']
+                image_urls.append(img_url)
+                text_div = item.find('div', class_='gallerytext')
+                if text_div:
+                    flag_text = text_div.get_text(strip=True)
+                    names.append(flag_text)  # Capture the entire text
+                else:
+                    names.append(None)
+            else:
+                image_urls.append(None)
 
-names.append('Guadeloupe (official)')
-image_urls.append('https://upload.wikimedia.org/wikipedia/commons/d/d1/Flag_of_Guadeloupe_%28UPLG%29.svg')
+        # Add additonal flags not found on wiki page
+        names.append('Guadeloupe (unofficial)')
+        image_urls.append('https://upload.wikimedia.org/wikipedia/commons/e/e7/Unofficial_flag_of_Guadeloupe_%28local%29.svg')
 
-names.append('French Guiana')
-image_urls.append('https://upload.wikimedia.org/wikipedia/commons/2/29/Flag_of_French_Guiana.svg')
+        names.append('Guadeloupe (official)')
+        image_urls.append('https://upload.wikimedia.org/wikipedia/commons/d/d1/Flag_of_Guadeloupe_%28UPLG%29.svg')
 
-names.append('Mayotte')
-image_urls.append('https://upload.wikimedia.org/wikipedia/commons/b/bf/Coat_of_Arms_of_Mayotte.svg')
+        names.append('French Guiana')
+        image_urls.append('https://upload.wikimedia.org/wikipedia/commons/2/29/Flag_of_French_Guiana.svg')
 
-names.append('Reunion')
-image_urls.append('https://upload.wikimedia.org/wikipedia/commons/8/8e/Proposed_flag_of_R%C3%A9union_%28VAR%29.svg')
+        names.append('Mayotte')
+        image_urls.append('https://upload.wikimedia.org/wikipedia/commons/b/bf/Coat_of_Arms_of_Mayotte.svg')
 
+        names.append('Reunion')
+        image_urls.append('https://upload.wikimedia.org/wikipedia/commons/8/8e/Proposed_flag_of_R%C3%A9union_%28VAR%29.svg')
 
-flags_df4 = pd.DataFrame({'Name': names, 'URL': image_urls})
-all_flags_df = pd.concat([all_flags_df, flags_df4], ignore_index=True)
+        return pd.DataFrame({'Name': names, 'URL': image_urls})
 
-# Clean up names by removing prefixes and unnecessary articles
-all_flags_df['Name'] = (
-    all_flags_df['Name']
-    .str.replace(r'(?i)^Flag\s*of\s*', '', regex=True)  # Remove "Flag of" (case insensitive)
-    .str.replace(r'(?i)^\s*the\s*', '', regex=True)  # Remove "the" at the beginning (case insensitive)
-    .str.replace(r'(?i)^\s*Flag\s*', '', regex=True)  # Remove "Flag" at the beginning (case insensitive)
-    .str.replace(r'\s+', ' ', regex=True)  # Replace multiple spaces with a single space
-    .str.strip()  # Remove any leading or trailing spaces
-)
+# Extractor for every page in source_pages, in the order their rows go into all_flags.csv
+page_extractors = {
+    'sovereign_states': SovereignStatesExtractor(),
+    'city_flags': CityFlagsExtractor(),
+    'dependent_territories': DependentTerritoriesExtractor(),
+}
 
 # Additional processing to handle unwanted entries
 def clean_city_name(name):
@@ -123,8 +279,6 @@ def clean_city_name(name):
         name = name.split(',')[0].strip()  # Return the part before the comma
     return name
 
-all_flags_df['Name'] = all_flags_df['Name'].apply(clean_city_name)
-
 # Filter to only keep valid flag entries
 unwanted_phrases = [
     'Wikipedia',
@@ -135,26 +289,151 @@ unwanted_phrases = [
     'most populated city',
     'free encyclopedia',
     'flag of the',
-    'flag of', 
+    'flag of',
     'Flags of',
-    'flag', 
+    'flag',
 ]
 
+# All unwanted phrases as one pattern, matched against lowercased names
+unwanted_pattern = re.compile('|'.join(re.escape(phrase.lower()) for phrase in unwanted_phrases))
+
+# "Flag of", then "the", then "Flag" at the start of a name (case insensitive), each with the
+# whitespace around it; the same as stripping them one after the other
+name_prefix = re.compile(r'^(?:Flag\s*of\s*)?(?:\s*the\s*)?(?:\s*Flag\s*)?', re.IGNORECASE)
+whitespace = re.compile(r'\s+')
+
 # Check if a name is valid
 def is_flag_entry(name):
     # Check if the name is valid by looking for keywords indicating a flag
-    if any(phrase.lower() in name.lower() for phrase in unwanted_phrases):
+    if unwanted_pattern.search(name.lower()):
         return False
     if len(name) < 3:  # Length check to avoid very short names
         return False
     return True
 
-# Apply the filtering function
-all_flags_df = all_flags_df[all_flags_df['Name'].apply(is_flag_entry)]
+# Clean up a name by removing prefixes and unnecessary articles, collapsing whitespace and
+# cutting city names down to the city
+def normalize_flag_name(name):
+    name = whitespace.sub(' ', name_prefix.sub('', name, count=1)).strip()
+    return clean_city_name(name)
+
+# Normalize every name in one pass, then keep the rows is_flag_entry would keep using a single
+# mask over the whole column. Rows without a name are dropped.
+def clean_flags(all_flags_df):
+    names = all_flags_df['Name']
+    all_flags_df['Name'] = [normalize_flag_name(name) if isinstance(name, str) else name for name in names]
+
+    names = all_flags_df['Name']
+    lowered = names.str.lower()
+    keep = ~lowered.str.contains(unwanted_pattern, na=True) & (names.str.len() >= 3)
+    return all_flags_df[keep]
+
+# Drop rows that repeat a value already seen in any of the given columns, keeping the first.
+# With the defaults every name and every image URL appears once.
+def dedupe_flags(all_flags_df, columns=('Name', 'URL')):
+    keep = None
+    for column in columns:
+        unique = ~all_flags_df[column].duplicated() | all_flags_df[column].isna()
+        keep = unique if keep is None else keep & unique
+    return all_flags_df if keep is None else all_flags_df[keep]
+
+# Parse the source pages (page name -> raw HTML) into one DataFrame of uncleaned names and URLs.
+# Pages that are missing or None are left out, except that the dependent territories extractor
+# always runs so the flags added by hand are kept. Frames in parsed (page name -> DataFrame, e.g.
+# the city flags crawl) are used in place of parsing that page.
+def parse_flags(pages, targeted=True, backend=None, parsed=None):
+    frames = []
+    for page, extractor in page_extractors.items():
+        if parsed and page in parsed:
+            frames.append(parsed[page])
+            continue
+        html = pages.get(page)
+        if html is None and page == 'dependent_territories':
+            html = b''
+        if html is not None:
+            frames.append(extractor.parse(html, targeted, backend))
+    return pd.concat(frames, ignore_index=True)
+
+# Fetch, parse and clean the pages in parallel, yielding (page, cleaned DataFrame) as soon as each
+# one is ready, so later stages can start on the first page while the others are still loading.
+# Pages are yielded in the order they finish; combine_pages puts them back in file order. A page
+# that couldn't be fetched (and isn't cached) is yielded with None, so the caller knows the
+# scrape is incomplete.
+def stream_flags(folder=cache_folder, offline=False):
+    session = create_session()
+    with ThreadPoolExecutor(max_workers=len(source_pages)) as executor:
+        futures = {executor.submit(fetch_page, session, page, url, folder, offline): page
+                   for page, url in source_pages.items()}
+        for future in as_completed(futures):
+            page = futures[future]
+            try:
+                html = future.result()
+            except Exception as e:
+                print(f"Skipping {page}: {e}")
+                html = None
+            yield page, None if html is None else clean_flags(page_extractors[page].parse(html))
+
+# Join cleaned per-page frames (page name -> DataFrame) in the order parse_flags uses
+def combine_pages(frames):
+    return pd.concat([frames[page] for page in page_extractors if page in frames], ignore_index=True)
+
+def build_flags(pages, dedupe=False, parsed=None):
+    all_flags_df = clean_flags(parse_flags(pages, parsed=parsed))
+    return dedupe_flags(all_flags_df) if dedupe else all_flags_df
+
+def save_flags(all_flags_df, path=output_path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    # Save the combined DataFrame to a single CSV file
+    all_flags_df.to_csv(path, index=False)
+
+def add_arguments(parser):
+    parser.add_argument("--offline", action="store_true",
+                        help="Rebuild all_flags.csv from the cached pages without using the network")
+    parser.add_argument("--cache-dir", default=cache_folder,
+                        help="Folder for cached pages (or saved fixture pages in offline mode)")
+    parser.add_argument("--output", default=output_path, help="CSV file to write")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="Keep only the first row for each name and for each image URL")
+    parser.add_argument("--crawl-cities", action="store_true",
+                        help="Crawl the per-country city flag lists instead of only reading the city flags index page")
+    parser.add_argument("--resume-crawl", action="store_true", help="Continue the city flags crawl from its checkpoint")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scrape flag names and image URLs from Wikipedia")
+    add_arguments(parser)
+    return parser.parse_args()
+
+# Pages that couldn't be fetched and have no cached copy
+def missing_pages(pages):
+    return [page for page in source_pages if pages.get(page) is None]
+
+def run(args):
+    pages = fetch_pages(args.cache_dir, args.offline)
+    missing = missing_pages(pages)
+    parsed = {}
+    if args.crawl_cities:
+        import city_crawler  # Only needed for the crawl
+        city_flags = city_crawler.crawl_city_flags(
+            folder=os.path.join(args.cache_dir, 'cities'), offline=args.offline, resume=args.resume_crawl,
+            checkpoint=os.path.join(args.cache_dir, 'city_crawl.json'))
+        if city_flags is None:
+            missing.append('city_flags (crawl)')
+        else:
+            parsed['city_flags'] = city_flags
+
+    # A partial all_flags.csv would make get_images.py delete every flag from the missing pages
+    if missing:
+        print(f"Not writing '{args.output}': {', '.join(missing)} could not be fetched. "
+              f"The previous file is kept; run again once the pages are reachable.")
+        raise SystemExit(1)
+
+    all_flags_df = build_flags(pages, args.dedupe, parsed)
+    save_flags(all_flags_df, args.output)
+    print(f"Data has been saved to '{args.output}'.")
 
-if not os.path.exists("csv"):
-    os.makedirs("csv")
+def main():
+    run(parse_args())
 
-# Save the combined DataFrame to a single CSV file
-all_flags_df.to_csv('csv/all_flags.csv', index=False)
-print("Data has been saved to 'all_flags.csv'.")
+if __name__ == "__main__":
+    main()